@@ -2,9 +2,22 @@ import uvicorn
 from .settings import settings
 
 
-uvicorn.run(
-    'app.app:app',
-    host=settings.server_host,
-    port=settings.server_port,
-    reload=True,
-)
+if settings.server_production:
+    uvicorn.run(
+        'app.app:app',
+        host=settings.server_host,
+        port=settings.server_port,
+        workers=settings.server_workers,
+        loop=settings.server_loop,
+        http=settings.server_http,
+        timeout_keep_alive=settings.server_keep_alive,
+        backlog=settings.server_backlog,
+        reload=False,
+    )
+else:
+    uvicorn.run(
+        'app.app:app',
+        host=settings.server_host,
+        port=settings.server_port,
+        reload=True,
+    )
@@ -0,0 +1,32 @@
+"""add trgm index monopoly
+
+Revision ID: 5d8e1a4b7c92
+Revises: 7f3b9d2c6e14
+Create Date: 2026-10-18 18:05:41.530218
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '5d8e1a4b7c92'
+down_revision = '7f3b9d2c6e14'
+branch_labels = None
+depends_on = None
+
+# Первоначальное выражение индекса; миграция e4b8d1f6a273 заменяет его нормализованным, как в
+# services.search.search_document(). Индекс нужен только PostgreSQL, в остальных базах поиск идёт по индексу в памяти
+DOCUMENT = '''(coalesce("companyName", '') || ' ' || coalesce(address, '') || ' ' || coalesce(region, ''))'''
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.execute(f'CREATE INDEX ix__monopoly__search_trgm ON monopoly USING gin ({DOCUMENT} gin_trgm_ops)')
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.drop_index('ix__monopoly__search_trgm', table_name='monopoly')
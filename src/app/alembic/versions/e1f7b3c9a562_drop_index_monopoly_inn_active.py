@@ -0,0 +1,26 @@
+"""drop index monopoly inn_active
+
+Revision ID: e1f7b3c9a562
+Revises: c6e2a9d4f813
+Create Date: 2026-10-18 18:47:09.331826
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'e1f7b3c9a562'
+down_revision = 'c6e2a9d4f813'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Частичный индекс по inn повторял уникальный uq__monopoly__inn. Миграция 7f3b9d2c6e14 его больше
+    # не создаёт, а в базах, где она уже выполнена, удаляем его здесь
+    op.execute('DROP INDEX IF EXISTS ix__monopoly__inn_active')
+
+
+def downgrade():
+    # Индекс не восстанавливается: проверку по ИНН обслуживает uq__monopoly__inn
+    pass
@@ -0,0 +1,33 @@
+"""normalize trgm index monopoly
+
+Revision ID: e4b8d1f6a273
+Revises: e1f7b3c9a562
+Create Date: 2026-10-18 19:06:52.718304
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4b8d1f6a273'
+down_revision = 'e1f7b3c9a562'
+branch_labels = None
+depends_on = None
+
+DOCUMENT = '''(coalesce("companyName", '') || ' ' || coalesce(address, '') || ' ' || coalesce(region, ''))'''
+# Выражение совпадает с services.search.search_document(): нижний регистр и «е» вместо «ё», как в normalize
+NORMALIZED = f'''translate(lower({DOCUMENT}), 'ё', 'е')'''
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.drop_index('ix__monopoly__search_trgm', table_name='monopoly')
+    op.execute(f'CREATE INDEX ix__monopoly__search_trgm ON monopoly USING gin (({NORMALIZED}) gin_trgm_ops)')
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.drop_index('ix__monopoly__search_trgm', table_name='monopoly')
+    op.execute(f'CREATE INDEX ix__monopoly__search_trgm ON monopoly USING gin ({DOCUMENT} gin_trgm_ops)')
@@ -1,27 +1,65 @@
-from fastapi import (APIRouter, Depends, Query, File)
+import re, json
+from datetime import date
+from typing import AsyncIterator, List, Optional
+from fastapi import (APIRouter, Depends, Query, File, Request, HTTPException, UploadFile, status)
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from .. import models
 from ..services.auth import get_current_user
-from ..database import get_session
-from ..services.monopoly import Monopoly, MonopolyParser
+from ..database import get_async_session, get_session
+from ..services.export import MEDIA_TYPES, MonopolyExport
+from ..services.jobs import RefreshJobs
+from ..services.monopoly import AsyncMonopoly, monopoly_cache, registry_etag, registry_version
+from ..services.search import MonopolySearch
+from ..settings import settings
 
 router = APIRouter(prefix='/api/v1')
 
+# ИНН российской компании - 10 цифр, ИП - 12 цифр
+INN_PATTERN = re.compile(r'^(?:[0-9]{10}|[0-9]{12})$')
 
-def get_monopoly(session: Session = Depends(get_session)):
-    return Monopoly(session=session)
+
+# Тело ответа 404 такое же, как у HTTPException(404), но без создания исключения на каждый промах
+NOT_FOUND_BODY = b'{"detail":"Not Found"}'
+
+
+def _not_modified(request: Request, etag: str) -> bool:
+    """ Совпадает ли ETag с одним из заголовка If-None-Match (слабое сравнение, как требует RFC 7232) """
+    header = request.headers.get('if-none-match')
+    if not header:
+        return False
+    tags = [tag.strip() for tag in header.split(',')]
+    return '*' in tags or etag in [tag[2:] if tag.startswith('W/') else tag for tag in tags]
+
+
+async def get_monopoly(session: AsyncSession = Depends(get_async_session)):
+    return AsyncMonopoly(session=session)
 
 
 def get_parser_momopoly(session: Session = Depends(get_session)):
+    # Разбор файлов загрузки (openpyxl) загружается при первой загрузке, а не при запуске воркера
+    from ..services.parser import MonopolyParser
     return MonopolyParser(session=session)
 
 
+def get_search(session: Session = Depends(get_session)):
+    return MonopolySearch(session=session)
+
+
+def get_refresh_jobs(session: Session = Depends(get_session)):
+    return RefreshJobs(session=session)
+
+
 @router.get('/monopoly_check')
-def check(
+async def check(
+        request: Request,
         inn: str = Query(..., min_length=10, max_length=12, regex="^[0-9]+$"),
         history: bool = False,
+        as_of: Optional[date] = None,
         # user: models.User = Depends(get_current_user),
-        monopoly: Monopoly = Depends(get_monopoly)
+        monopoly: AsyncMonopoly = Depends(get_monopoly)
 ):
     """
     Метод предназначен для проверки вхождения российской компании в список естественных монополий
@@ -30,38 +68,219 @@ def check(
 
     - **inn**: регистрационный код ИНН российской компании.
     - **history**: признак использования исторических данных. False - проверяем вхождение на текущий момент, True - проверяем, что когда-либо компания была в списке.  По умолчанию False.
+    - **as_of**: дата в формате YYYY-MM-DD - проверяем, была ли компания в списке в этот день, и возвращаем действовавшие в этот день данные (**validFrom**, **validTo** - период действия версии). Если указана, history не учитывается.
 
     Выходные данные:
 
     - status_code 200 - компания находится в списке естественных монополий, status_code 404 - компании нет в списке
+    - заголовки **ETag** (меняется после каждого успешного обновления списка) и **Cache-Control**; на запрос
+      с тем же ETag в **If-None-Match** до следующего обновления возвращается status_code 304
+    """
+    etag = registry_etag()
+    headers = {} if etag is None else {'ETag': etag, 'Cache-Control': f'public, max-age={settings.check_max_age}'}
+    if etag is not None and _not_modified(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    body = await monopoly.get_encoded(inn=inn, history=history, as_of=as_of)
+    if body is None:
+        return Response(NOT_FOUND_BODY, status_code=status.HTTP_404_NOT_FOUND, media_type='application/json',
+                        headers=headers)
+    return Response(body, media_type='application/json', headers=headers)
+
+
+def _read_inns(body: bytes, content_type: str) -> List[str]:
+    """ Извлекаем список ИНН из тела запроса: JSON или текст с одним ИНН на строку """
+    if content_type.startswith('application/json'):
+        try:
+            data = json.loads(body)
+        except ValueError:
+            raise HTTPException(status.HTTP_422_UNPROCESSABLE_ENTITY, detail='Invalid JSON body')
+        if isinstance(data, dict):
+            data = data.get('inns')
+        if not isinstance(data, list):
+            raise HTTPException(status.HTTP_422_UNPROCESSABLE_ENTITY, detail='Expected a list of INN')
+        return [str(inn).strip() for inn in data]
+    return [line.strip() for line in body.decode('utf-8-sig').splitlines() if line.strip()]
+
+
+async def _batch_results(monopoly: AsyncMonopoly, inns: List[str], history: bool) -> AsyncIterator[str]:
+    """ Формируем JSON массив результатов по частям, по мере проверки пачек ИНН """
+    found = monopoly.lookup_many((inn for inn in inns if INN_PATTERN.match(inn)), history)
+    parts = ['[']
+    for number, inn in enumerate(inns):
+        if INN_PATTERN.match(inn):
+            _, company = await found.__anext__()
+            item = {'inn': inn, 'status': status.HTTP_200_OK if company else status.HTTP_404_NOT_FOUND,
+                    'company': company}
+        else:
+            item = {'inn': inn, 'status': status.HTTP_422_UNPROCESSABLE_ENTITY, 'company': None}
+        parts.append((',' if number else '') + json.dumps(jsonable_encoder(item), ensure_ascii=False))
+        if len(parts) >= settings.batch_chunk_size:
+            yield ''.join(parts)
+            parts = []
+    parts.append(']')
+    yield ''.join(parts)
+
+
+@router.post('/monopoly_check_batch')
+async def check_batch(
+        request: Request,
+        history: bool = False,
+        # user: models.User = Depends(get_current_user),
+        monopoly: AsyncMonopoly = Depends(get_monopoly)
+):
+    """
+    Метод предназначен для проверки списка российских компаний на вхождение в список естественных монополий
+
+    Входные данные:
+
+    - тело запроса **application/json**: список ИНН `["7707083893", ...]` или объект `{"inns": [...]}`
+    - тело запроса **text/plain**: ИНН по одному на строку (для больших списков)
+    - **history**: признак использования исторических данных, как в monopoly_check. По умолчанию False.
+
+    Выходные данные:
+
+    - JSON массив в порядке входного списка: `{"inn": ..., "status": ..., "company": ...}`,
+      где status 200 - компания находится в списке, 404 - компании нет в списке, 422 - ИНН не 10 и не 12 цифр
+    - status_code 413 - в запросе больше ИНН, чем допускает настройка batch_max_size
+    """
+    inns = _read_inns(await request.body(), request.headers.get('content-type', ''))
+    if len(inns) > settings.batch_max_size:
+        raise HTTPException(status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                            detail=f'Too many INN, max {settings.batch_max_size}')
+    return StreamingResponse(_batch_results(monopoly, inns, history), media_type='application/json')
+
+
+@router.get('/monopoly_search')
+def search(
+        q: str = Query(..., min_length=2, max_length=512),
+        history: bool = False,
+        page: int = Query(1, ge=1),
+        size: int = Query(20, ge=1, le=settings.search_max_size),
+        # user: models.User = Depends(get_current_user),
+        monopoly_search: MonopolySearch = Depends(get_search)
+):
+    """
+    Метод предназначен для поиска компаний в списке естественных монополий, когда ИНН неизвестен
+
+    Входные данные:
+
+    - **q**: часть наименования, адреса или региона. Регистр, кавычки и организационно-правовые формы
+      (ООО, АО, ПАО, ...) не учитываются, слова допускают опечатки и неполное написание.
+    - **history**: False - только компании, которые находятся в списке на текущий момент, True - в том числе
+      исключённые. По умолчанию False.
+    - **page**, **size**: номер страницы с 1 и размер страницы (не больше search_max_size).
+
+    Выходные данные:
+
+    - **items** - данные компаний по убыванию **score** (от 0 до 1 - степень совпадения с запросом)
+    - **more** - есть следующая страница, **query** - запрос после нормализации
+    - status_code 422 - в запросе нет слов, кроме организационно-правовых форм
+    """
+    return monopoly_search.search(q, history=history, page=page, size=size)
+
+
+@router.get('/monopoly_cache_stats')
+def cache_stats(
+        # user: models.User = Depends(get_current_user),
+):
     """
-    return monopoly.get(inn=inn, history=history)
+    Метод предназначен для контроля работы кэша проверок monopoly_check
 
+    Выходные данные:
+
+    - **size**, **maxsize**, **ttl** - текущее и максимальное количество записей, время жизни записи в секундах
+    - **hits**, **misses**, **evictions** - количество попаданий, промахов и вытесненных записей
+    """
+    return monopoly_cache.stats()
 
-@router.get('/monopoly_update')
+
+@router.get('/monopoly_export')
+def export(
+        request: Request,
+        format: str = Query('csv', regex='^(csv|jsonl|parquet)$'),
+        active_only: bool = False,
+        region: Optional[str] = None,
+        registry: Optional[str] = None,
+        # user: models.User = Depends(get_current_user),
+        session: Session = Depends(get_session)
+):
+    """
+    Метод предназначен для выгрузки списка естественных монополий целиком
+
+    Входные данные:
+
+    - **format**: csv, jsonl (JSON Lines - объект компании на строку) или parquet. По умолчанию csv.
+    - **active_only**: только компании, которые находятся в списке на текущий момент. По умолчанию False.
+    - **region**, **registry**: только компании указанного региона, реестра.
+    - заголовок **If-None-Match**: ETag предыдущей выгрузки с теми же параметрами.
+
+    Выходные данные:
+
+    - status_code 200 - файл выгрузки, заголовок **ETag** меняется после каждого успешного обновления списка
+    - status_code 304 - список не обновлялся с выгрузки, ETag которой передан в If-None-Match
+    """
+    exporter = MonopolyExport(session, active_only=active_only, region=region, registry=registry)
+    etag = exporter.etag(registry_version(session), format)
+    headers = {'ETag': etag}
+    if _not_modified(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    headers['Content-Disposition'] = f'attachment; filename="monopoly.{format}"'
+    return StreamingResponse(exporter.chunks(format), media_type=MEDIA_TYPES[format], headers=headers)
+
+
+@router.post('/monopoly_update', response_model=models.MonopolyRefresh, status_code=status.HTTP_202_ACCEPTED)
+# GET оставлен для существующих клиентов: запрос меняет состояние, и его могут повторить обходчики и кэши
+@router.get('/monopoly_update', response_model=models.MonopolyRefresh, status_code=status.HTTP_202_ACCEPTED,
+            deprecated=True)
 def monopoly_update_data(
         # user: models.User = Depends(get_current_user),
-        parser: MonopolyParser = Depends(get_parser_momopoly)
+        jobs: RefreshJobs = Depends(get_refresh_jobs)
 ):
     """
     Метод предназначен для обновления списока естестенных монополий с сайта ФАС
 
+    Обновление ставится в очередь и выполняется в фоне (воркером app.worker или планировщиком приложения).
+    Если обновление уже ожидает выполнения или выполняется - возвращается это задание.
+    Метод POST; GET устарел и будет удалён.
+
+    Выходные данные:
+
+    - status_code 202 - задание принято, **id** - номер задания для monopoly_update/{id}
+    - **status** - queued, running, success или failed
+    """
+    return jobs.enqueue()
+
+
+@router.get('/monopoly_update/{job_id}', response_model=models.MonopolyRefresh)
+def monopoly_update_status(
+        job_id: int,
+        # user: models.User = Depends(get_current_user),
+        jobs: RefreshJobs = Depends(get_refresh_jobs)
+):
+    """
+    Метод предназначен для получения состояния задания на обновление списка естестенных монополий
+
     Выходные данные:
 
-    - status_code 200 - обновление прошло успешно, status_code 400 - возникла ошибка при обновлении
+    - **status** - queued, running, success или failed (**error** - описание ошибки)
+    - **rows** - количество строк в списке ФАС
+    - **inserted**, **updated**, **touched**, **removed** - количество добавленных, изменившихся, подтверждённых
+      без изменений и исключённых компаний
+    - status_code 404 - задания с таким номером нет
     """
-    return parser.parser_monopoly()
+    return jobs.get(job_id)
 
 
 @router.post("/manual_file_upload/")
 def manual_file_upload(
         # user: models.User = Depends(get_current_user),
-        parser: MonopolyParser = Depends(get_parser_momopoly),
-        file: bytes = File(...)
+        parser=Depends(get_parser_momopoly),
+        file: UploadFile = File(...)
 ):
     """
     ## Ручная загрузка списка естестенных монополий
-    Загружаем файл EXCEL с фиксированными заголовками. Данные перезаписываются поверх существующих в базе.
+    Загружаем файл EXCEL (или CSV для очень больших списков, UTF-8, разделитель `,` или `;`) с фиксированными
+    заголовками. Данные перезаписываются поверх существующих в базе. Файл загружается целиком одной транзакцией.
 
     ИНН является ключевым значением по которому проводится проверка, поэтому в случае если в таблице, в поле ИНН
     встретится пустая строка, скрипт завершится с ошибкой **status_code 400** - **"Error parse data"**
@@ -74,4 +293,4 @@ def manual_file_upload(
     | ---- | -------- | ------- | --------------- | ------ | -------------------- | ------- | ---------------- |
     | inn  | registry | section | docNumber       | region | companyName          | address | dateFirstReg     |
     """
-    return parser.monopoly_upload(file)
+    return parser.monopoly_upload(file.file, file.filename or '')
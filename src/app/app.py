@@ -1,9 +1,11 @@
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi_utils.tasks import repeat_every
-from . import api
-from .services.monopoly import MonopolyParser
-from .database import Session
+from . import api, metrics
+from .services.jobs import RefreshJobs
+from .services.monopoly import publish_lookup_file, refresh_read_path, sync_read_path
+from .database import Session, engine
 from .settings import LOGGER, settings
 
 app = FastAPI(
@@ -21,16 +23,45 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.add_middleware(metrics.MetricsMiddleware)
+
 app.include_router(api.router)
 
 
+@app.get('/metrics', response_class=PlainTextResponse, include_in_schema=False)
+def metrics_endpoint():
+    """ Метрики процесса в текстовом формате Prometheus """
+    return PlainTextResponse(metrics.render(), media_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@app.on_event('startup')
+def load_read_path():
+    """
+    Запоминаем номер последнего обновления списка (ETag ответов проверки) и загружаем список в память,
+    если проверки обслуживаются из снимка, и индекс поиска. Если файла поиска по ИНН нет
+    или он записан для другой версии списка, записываем его
+    """
+    session = Session()
+    try:
+        refresh_read_path(session)
+        publish_lookup_file(session, force=False)
+    finally:
+        session.close()
+
+
 @app.on_event('startup')
-@repeat_every(seconds=settings.scheduler_period, logger=LOGGER, wait_first=True)
+@repeat_every(seconds=settings.worker_poll_interval, logger=LOGGER, wait_first=True)
 def run_scheduler():
-    """ Функция парсинга списка естественных монополий с сайта ФАС по расписанию """
-    LOGGER.info("Start parsing -----------------------")
+    """
+    Функция парсинга списка естественных монополий с сайта ФАС по расписанию и по заданиям из очереди.
+    Обновление выполняет только один процесс; при scheduler_in_app=False его выполняет python -m app.worker.
+    Пока обновлять нечего, опрос - два запроса к monopoly_refresh и registry_version, без advisory lock
+    """
     session = Session()
-    task = MonopolyParser(session)
-    task.parser_monopoly()
-    session.close()
-    LOGGER.info("End parsing -------------------------")
+    try:
+        if settings.scheduler_in_app:
+            RefreshJobs(session).run_pending(engine)
+        # Подхватываем обновление, выполненное другим процессом
+        sync_read_path(session)
+    finally:
+        session.close()
@@ -1,9 +1,103 @@
-from sqlalchemy import create_engine
+import time
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncSession as AsyncSessionClass, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 
+from .metrics import Counter, Gauge, Histogram
 from .settings import settings
 
-engine = create_engine(settings.database_url)
+DB_POOL_CHECKED_OUT = Gauge('db_pool_checked_out', 'Connections currently checked out from the pool', ('engine',))
+DB_POOL_OVERFLOW = Gauge('db_pool_overflow', 'Connections opened above pool_size', ('engine',))
+DB_POOL_SIZE = Gauge('db_pool_size', 'Configured pool size', ('engine',))
+DB_POOL_CONNECTIONS = Counter('db_pool_connections_total', 'New DBAPI connections opened', ('engine',))
+DB_POOL_TIMEOUTS = Counter('db_pool_timeouts_total', 'Checkouts that failed with pool_timeout', ('engine',))
+DB_POOL_WAIT = Histogram('db_pool_wait_seconds', 'Time spent waiting for a pool connection', ('engine',),
+                         buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0))
+
+
+class _TimedPoolMixin:
+    """ Замеряем ожидание соединения из пула: время вызова _do_get, включая открытие нового соединения """
+    engine_name = ''
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            DB_POOL_TIMEOUTS.inc(engine=self.engine_name)
+            raise
+        finally:
+            DB_POOL_WAIT.observe(time.perf_counter() - started, engine=self.engine_name)
+
+
+class TimedQueuePool(_TimedPoolMixin, QueuePool):
+    engine_name = 'sync'
+
+
+class TimedAsyncQueuePool(_TimedPoolMixin, AsyncAdaptedQueuePool):
+    engine_name = 'async'
+
+
+# Асинхронные драйверы для синхронных адресов базы данных
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'postgresql+psycopg2': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+}
+
+
+def async_database_url(url: str) -> str:
+    """ Адрес базы данных для асинхронного движка: заменяем синхронный драйвер на асинхронный """
+    scheme, separator, rest = url.partition('://')
+    return ASYNC_DRIVERS.get(scheme, scheme) + separator + rest
+
+
+def engine_options(url: str, is_async: bool = False) -> dict:
+    """ Параметры пула соединений и таймаут запросов из настроек. Для SQLite используется пул по умолчанию """
+    if url.startswith('sqlite'):
+        return {}
+    options = {
+        'poolclass': TimedAsyncQueuePool if is_async else TimedQueuePool,
+        'pool_size': settings.db_pool_size,
+        'max_overflow': settings.db_max_overflow,
+        'pool_timeout': settings.db_pool_timeout,
+        'pool_recycle': settings.db_pool_recycle,
+        'pool_pre_ping': settings.db_pool_pre_ping,
+    }
+    if settings.db_statement_timeout and url.startswith('postgresql'):
+        # Таймаут выполнения запроса на стороне сервера, мс
+        if is_async:
+            options['connect_args'] = {'server_settings': {'statement_timeout': str(settings.db_statement_timeout)}}
+        else:
+            options['connect_args'] = {'options': f'-c statement_timeout={settings.db_statement_timeout}'}
+    return options
+
+
+def instrument_pool(sync_engine, name: str):
+    """ Публикуем состояние пула соединений в метриках через события пула SQLAlchemy """
+
+    @event.listens_for(sync_engine, 'connect')
+    def on_connect(dbapi_connection, connection_record):
+        DB_POOL_CONNECTIONS.inc(engine=name)
+
+    @event.listens_for(sync_engine, 'checkout')
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        DB_POOL_CHECKED_OUT.inc(engine=name)
+
+    @event.listens_for(sync_engine, 'checkin')
+    def on_checkin(dbapi_connection, connection_record):
+        DB_POOL_CHECKED_OUT.dec(engine=name)
+
+    if isinstance(sync_engine.pool, QueuePool):
+        # Пул пересоздаётся при dispose, поэтому обращаемся к текущему пулу движка
+        DB_POOL_OVERFLOW.set_function(lambda: max(sync_engine.pool.overflow(), 0), engine=name)
+        DB_POOL_SIZE.set_function(lambda: sync_engine.pool.size(), engine=name)
+
+
+engine = create_engine(settings.database_url, **engine_options(settings.database_url))
+instrument_pool(engine, 'sync')
 
 Session = sessionmaker(
     engine,
@@ -11,6 +105,26 @@ Session = sessionmaker(
     autoflush=False,
 )
 
+# Асинхронный движок для endpoint'ов чтения; alembic и парсер работают через синхронный engine.
+# Создаётся при первом обращении: парсеру, app.worker и скриптам асинхронный драйвер не нужен
+_async_sessionmaker = None
+
+
+def async_session() -> AsyncSessionClass:
+    """ Новая асинхронная сессия; при первом вызове создаём асинхронный движок """
+    global _async_sessionmaker
+    if _async_sessionmaker is None:
+        url = settings.async_database_url or async_database_url(settings.database_url)
+        async_engine = create_async_engine(url, **engine_options(url, is_async=True))
+        instrument_pool(async_engine.sync_engine, 'async')
+        _async_sessionmaker = sessionmaker(
+            async_engine,
+            class_=AsyncSessionClass,
+            autoflush=False,
+            expire_on_commit=False,
+        )
+    return _async_sessionmaker()
+
 
 def get_session():
     """ Создаём сессию для запросов в базу данных """
@@ -19,3 +133,12 @@ def get_session():
         yield session
     finally:
         session.close()
+
+
+async def get_async_session():
+    """
+    Создаём асинхронную сессию для запросов в базу данных из event loop.
+    Соединение сессия берёт из пула только при первом запросе, поэтому ответы из кэша и снимка его не занимают
+    """
+    async with async_session() as session:
+        yield session
@@ -0,0 +1,50 @@
+import argparse, sys
+import orjson
+from .services.cache import MISSING
+from .services.lookup_file import LookupFile, write_lookup_file
+from .settings import settings
+
+
+def main():
+    """
+    Файл поиска по ИНН для пакетных задач без обращения к сервису и базе:
+
+        python -m app.lookup build [--path /data/monopoly.lookup]
+        python -m app.lookup check [--path ...] [--history] 7707083893 ...
+        python -m app.lookup check < inns.txt > result.jsonl
+
+    check выводит JSON Lines: {"inn": ..., "company": {...} или null}. ИНН не из цифр выводятся с "company": null
+    """
+    arguments = argparse.ArgumentParser(prog='python -m app.lookup', description=main.__doc__,
+                                        formatter_class=argparse.RawDescriptionHelpFormatter)
+    arguments.add_argument('command', choices=('build', 'check'))
+    arguments.add_argument('inns', nargs='*', help='ИНН для check; без них ИНН читаются из stdin по одному на строку')
+    arguments.add_argument('--path', default=settings.lookup_file, help='путь к файлу, по умолчанию LOOKUP_FILE')
+    arguments.add_argument('--history', action='store_true', help='учитывать исключённые из списка компании')
+    args = arguments.parse_intermixed_args()
+    if not args.path:
+        arguments.error('--path or LOOKUP_FILE is required')
+
+    if args.command == 'build':
+        from .database import Session
+        from .services.monopoly import registry_version
+        session = Session()
+        try:
+            rows = write_lookup_file(session, args.path, registry_version(session))
+        finally:
+            session.close()
+        print(f'{args.path}: {rows} rows')
+        return
+
+    lookup = LookupFile(args.path)
+    inns = args.inns or (line.strip() for line in sys.stdin if line.strip())
+    output = sys.stdout.buffer
+    for inn in inns:
+        company = lookup.find(inn, args.history)
+        if company is MISSING or company is None:
+            company = b'null'
+        output.write(b'{"inn":' + orjson.dumps(inn) + b',"company":' + company + b'}\n')
+
+
+if __name__ == '__main__':
+    main()
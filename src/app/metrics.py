@@ -0,0 +1,197 @@
+import math, threading, time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Tuple
+
+# Границы корзин гистограмм по умолчанию, в секундах
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Все метрики процесса в порядке объявления
+REGISTRY: List['Metric'] = []
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple, extra: str = '') -> str:
+    pairs = [
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in zip(names, values)
+    ]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Metric:
+    """ Метрика в формате Prometheus с набором меток. Значения хранятся в памяти процесса """
+    type = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple, object] = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: dict) -> Tuple:
+        return tuple(labels.get(name, '') for name in self.labelnames)
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        lines.extend(self._samples())
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    """ Монотонно растущий счётчик """
+    type = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}' for key, value in items]
+
+
+class Gauge(Metric):
+    """ Текущее значение. Значение может вычисляться функцией в момент выдачи метрик """
+    type = 'gauge'
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            value = self._values.get(key, 0)
+            self._values[key] = (value if not callable(value) else 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function: Callable[[], float], **labels):
+        with self._lock:
+            self._values[self._key(labels)] = function
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [
+            f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value() if callable(value) else value)}'
+            for key, value in items
+        ]
+
+
+class Histogram(Metric):
+    """ Распределение значений по корзинам, сумма и количество наблюдений """
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            data = self._values.get(key)
+            if data is None:
+                data = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            data[0][bisect_left(self.buckets, value)] += 1
+            data[1] += value
+            data[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """ Замеряем время выполнения блока with """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = [(key, (list(data[0]), data[1], data[2])) for key, data in self._values.items()]
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, counts):
+                cumulative += bucket
+                labels = _format_labels(self.labelnames, key, 'le="{}"'.format(_format_value(bound)))
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+def render() -> str:
+    """ Все метрики процесса в текстовом формате Prometheus """
+    return '\n'.join(metric.render() for metric in REGISTRY) + '\n'
+
+
+HTTP_REQUESTS = Counter('http_requests_total', 'HTTP requests by route and status', ('method', 'route', 'status'))
+HTTP_LATENCY = Histogram('http_request_duration_seconds', 'HTTP request latency including the response body',
+                         ('method', 'route'))
+HTTP_IN_FLIGHT = Gauge('http_requests_in_flight', 'HTTP requests being processed')
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware: задержка, количество ответов по статусам и количество выполняемых запросов.
+    Метка route - шаблон пути endpoint'а, чтобы количество рядов не зависело от параметров запроса
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._routes = None
+
+    def _route(self, scope) -> str:
+        endpoint = scope.get('endpoint')
+        if endpoint is None:
+            return 'unmatched'
+        if self._routes is None:
+            self._routes = {
+                route.endpoint: route.path for route in scope['app'].routes if hasattr(route, 'endpoint')
+            }
+        return self._routes.get(endpoint, 'unmatched')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            HTTP_IN_FLIGHT.dec()
+            route = self._route(scope)
+            HTTP_REQUESTS.inc(method=scope['method'], route=route, status=status_code)
+            HTTP_LATENCY.observe(elapsed, method=scope['method'], route=route)
@@ -1,3 +1,5 @@
+from datetime import datetime
+from typing import Optional
 from pydantic import BaseModel
 
 
@@ -16,3 +18,20 @@ class Monopoly(BaseMonopoly):
 
     class Config:
         orm_mode = True
+
+
+class MonopolyRefresh(BaseModel):
+    id: int
+    status: str
+    error: Optional[str]
+    createdAt: Optional[datetime]
+    startedAt: Optional[datetime]
+    finishedAt: Optional[datetime]
+    rows: Optional[int]
+    inserted: Optional[int]
+    updated: Optional[int]
+    touched: Optional[int]
+    removed: Optional[int]
+
+    class Config:
+        orm_mode = True
@@ -1,45 +1,171 @@
-import requests, json
+import json, base64, hashlib, threading, time
+import requests
+from typing import Optional
 from fastapi import (Depends, HTTPException, status, )
 from fastapi.security import OAuth2PasswordBearer
+from requests import RequestException
+from requests.adapters import HTTPAdapter
 from .. import (models)
-from ..settings import settings
+from .cache import LRUCache, MISSING
+from ..settings import settings, LOGGER
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl=settings.bl_auth_url)
 
+# Общий пул соединений с сервисом авторизации, создаётся при первом обращении к сервису
+_auth_http = None
+_auth_http_lock = threading.Lock()
+
+
+def auth_http():
+    global _auth_http
+    if _auth_http is None:
+        with _auth_http_lock:
+            if _auth_http is None:
+                session = requests.Session()
+                session.mount('http://', HTTPAdapter(pool_maxsize=settings.auth_pool_size))
+                session.mount('https://', HTTPAdapter(pool_maxsize=settings.auth_pool_size))
+                _auth_http = session
+    return _auth_http
+
+
+# Проверенные токены пользователей и отклонённые токены, ключ - sha256 токена
+verified_tokens = LRUCache(maxsize=settings.auth_cache_size, ttl=settings.auth_cache_ttl)
+rejected_tokens = LRUCache(maxsize=settings.auth_cache_size, ttl=settings.auth_negative_ttl)
+
 
 def get_current_user(token: str = Depends(oauth2_scheme)) -> models.User:
     return AuthService.verify_token(token)
 
 
+def _token_expires(token: str) -> Optional[float]:
+    """ Время истечения JWT токена (поле exp) без проверки подписи, None - если токен не JWT """
+    try:
+        payload = token.split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload))['exp'])
+    except (IndexError, ValueError, KeyError, TypeError):
+        return None
+
+
+def _token_key(token: str) -> str:
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+def _unavailable() -> HTTPException:
+    """ Сервис авторизации недоступен или ответил ошибкой: запрос отклоняем, но токен не считаем отклонённым """
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail='Authorization service unavailable',
+    )
+
+
+class ServiceToken:
+    """ Сервисный токен, который переиспользуется до истечения срока и обновляется в фоне заранее """
+
+    def __init__(self):
+        self.token = None
+        self.expires = 0.0
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def _fetch(self, exception: HTTPException) -> str:
+        token = AuthService.get_service_token(exception)
+        if token is None:
+            raise _unavailable()
+        self.expires = _token_expires(token) or time.time() + settings.auth_service_token_ttl
+        self.token = token
+        return token
+
+    def _refresh_in_background(self):
+        exception = HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
+        try:
+            with self._lock:
+                self._fetch(exception)
+        except Exception as error:
+            LOGGER.info('Error refresh service token: %s', error)
+        finally:
+            self._refreshing = False
+
+    def get(self, exception: HTTPException) -> str:
+        now = time.time()
+        if self.token is not None and now < self.expires:
+            if now > self.expires - settings.auth_service_token_margin and not self._refreshing:
+                self._refreshing = True
+                threading.Thread(target=self._refresh_in_background, daemon=True).start()
+            return self.token
+        with self._lock:
+            if self.token is not None and time.time() < self.expires:
+                return self.token
+            return self._fetch(exception)
+
+    def invalidate(self):
+        self.token = None
+        self.expires = 0.0
+
+
+service_token = ServiceToken()
+
+
 class AuthService:
 
     @classmethod
     def get_service_token(cls, exception: HTTPException):
         data = {"username": settings.bl_auth_user, "password": settings.bl_auth_password}
         headers = {"accept": "application/json", "Content-Type": "application/x-www-form-urlencoded"}
-        response = requests.post(settings.bl_auth_url, data=data, headers=headers)
+        http = auth_http()
+        try:
+            response = http.post(settings.bl_auth_url, data=data, headers=headers, timeout=settings.auth_timeout)
+        except RequestException as error:
+            LOGGER.info('Error get service token: %s', error)
+            raise _unavailable()
         if response.status_code == 200:
             try:
                 data = json.loads(response.text)
                 token = data['access_token']
                 return token
-            except TypeError:
-                raise exception
+            except (TypeError, ValueError, KeyError):
+                raise _unavailable()
+        LOGGER.info('Error get service token: status %s', response.status_code)
         return None
 
     @classmethod
     def get_user(cls, service_token: str, user_token: str, exception: HTTPException):
+        """
+        Данные пользователя. exception - сервис отклонил токен пользователя, None - сервис ответил 401/403
+        (отклонил токен пользователя или сервисный токен), 503 - сервис недоступен или ответил ошибкой
+        """
         headers = {"accept": "application/json", "Authorization": "Bearer " + service_token}
-        response = requests.get(settings.bl_auth_verify_url + '?token=' + user_token, headers=headers)
+        http = auth_http()
+        try:
+            response = http.get(settings.bl_auth_verify_url, params={'token': user_token}, headers=headers,
+                                timeout=settings.auth_timeout)
+        except RequestException as error:
+            LOGGER.info('Error verify user token: %s', error)
+            raise _unavailable()
         if response.status_code == 200:
             try:
                 data = json.loads(response.text)
-                if data['status'] is not True:
-                    raise exception
-            except TypeError:
+                verified = data['status'] is True
+            except (TypeError, ValueError, KeyError):
+                raise _unavailable()
+            if not verified:
                 raise exception
             return data
-        return None
+        if response.status_code in (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN):
+            return None
+        LOGGER.info('Error verify user token: status %s', response.status_code)
+        raise _unavailable()
+
+    @classmethod
+    def _check_user(cls, token: str, user_token: str, key: str, exception: HTTPException):
+        """ Проверяем токен пользователя, отклонённый токен запоминаем на auth_negative_ttl """
+        try:
+            return cls.get_user(token, user_token, exception)
+        except HTTPException as error:
+            # Недоступность сервиса (503) не говорит о том, что токен недействителен
+            if error is exception:
+                rejected_tokens.set(key, True)
+            raise
 
     @classmethod
     def verify_token(cls, user_token: str) -> models.User:
@@ -48,5 +174,28 @@ class AuthService:
             detail='Could not validate credentials',
             headers={'WWW-Authenticate': 'Bearer'},
         )
-        service_token = cls.get_service_token(exception)
-        return cls.get_user(service_token, user_token, exception)
+        key = _token_key(user_token)
+        if rejected_tokens.get(key) is not MISSING:
+            raise exception
+        user = verified_tokens.get(key)
+        if user is not MISSING:
+            return user
+
+        user = cls._check_user(service_token.get(exception), user_token, key, exception)
+        if user is None:
+            # Сохранённый сервисный токен мог быть отозван - получаем новый и проверяем ещё раз
+            service_token.invalidate()
+            user = cls._check_user(service_token.get(exception), user_token, key, exception)
+        if user is None:
+            # Сервис отклонил токен и с новым сервисным токеном
+            rejected_tokens.set(key, True)
+            raise exception
+
+        # Не храним проверенный токен дольше срока его действия
+        ttl = settings.auth_cache_ttl
+        expires = _token_expires(user_token)
+        if expires is not None:
+            ttl = min(ttl, expires - time.time())
+        if ttl > 0:
+            verified_tokens.set(key, user, ttl)
+        return user
@@ -0,0 +1,62 @@
+import threading, time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+# Признак отсутствия ключа в кэше (None - допустимое значение, им кэшируется отрицательный ответ)
+MISSING = object()
+
+
+class LRUCache:
+    """ Потокобезопасный LRU кэш с ограничением по количеству записей и времени их жизни """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Any:
+        """ Возвращаем значение из кэша или MISSING, если его нет либо срок жизни истёк """
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                expires, value = item
+                if expires > now:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return MISSING
+
+    def set(self, key: Hashable, value: Any, ttl: float = None):
+        """ Сохраняем значение, вытесняя самые давно использованные записи при переполнении """
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """ Сбрасываем все записи кэша (счётчики сохраняются) """
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        """ Счётчики кэша для подбора его размера """
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
@@ -0,0 +1,123 @@
+import csv, hashlib, io
+import orjson
+from typing import Iterator, List, Optional
+from sqlalchemy import select
+from .. import tables
+from ..settings import settings
+
+# Колонки выгрузки - все поля таблицы, кроме внутреннего id
+COLUMNS = tuple(column for column in tables.Monopoly.__table__.columns if column.name != 'id')
+
+MEDIA_TYPES = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+
+class _ChunkSink(io.RawIOBase):
+    """ Файл для ParquetWriter, который накапливает записанные байты до очередной выдачи клиенту """
+
+    def __init__(self):
+        super().__init__()
+        self.parts = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self.parts.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def drain(self) -> bytes:
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+class MonopolyExport:
+    """
+    Класс выгрузки списка естественных монополий в CSV, JSON Lines или Parquet.
+    Строки читаются курсором на стороне сервера пачками по export_chunk_size, поэтому память не зависит от размера таблицы
+    """
+
+    def __init__(self, session, active_only: bool = False, region: Optional[str] = None, registry: Optional[str] = None):
+        self.session = session
+        self.active_only = active_only
+        self.region = region
+        self.registry = registry
+
+    def etag(self, version: Optional[int], export_format: str) -> str:
+        """ ETag выгрузки: номер последнего успешного обновления списка и параметры выгрузки """
+        key = '|'.join(str(value) for value in (export_format, self.active_only, self.region, self.registry))
+        return '"export-%s-%s"' % (version or 0, hashlib.sha1(key.encode('utf-8')).hexdigest()[:16])
+
+    def _query(self):
+        table = tables.Monopoly.__table__
+        query = select(*COLUMNS).order_by(table.c.id)
+        if self.active_only:
+            query = query.where(table.c.removeDate == None)
+        if self.region is not None:
+            query = query.where(table.c.region == self.region)
+        if self.registry is not None:
+            query = query.where(table.c.registry == self.registry)
+        return query
+
+    def partitions(self) -> Iterator[List[tuple]]:
+        """ Строки выгрузки пачками; stream_results - серверный курсор вместо загрузки результата целиком """
+        result = self.session.execute(self._query().execution_options(stream_results=True))
+        try:
+            yield from result.partitions(settings.export_chunk_size)
+        finally:
+            result.close()
+
+    def csv_chunks(self) -> Iterator[bytes]:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow([column.name for column in COLUMNS])
+        for rows in self.partitions():
+            writer.writerows(rows)
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue().encode('utf-8')
+
+    def jsonl_chunks(self) -> Iterator[bytes]:
+        names = [column.name for column in COLUMNS]
+        for rows in self.partitions():
+            # orjson пишет даты в isoformat и текст в UTF-8 - как json.dumps(..., ensure_ascii=False)
+            yield b''.join(orjson.dumps(dict(zip(names, row)), option=orjson.OPT_APPEND_NEWLINE) for row in rows)
+
+    def parquet_chunks(self) -> Iterator[bytes]:
+        """ Parquet с группой строк на каждую пачку. pyarrow загружается при первой выгрузке, а не при запуске """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        types = {'Date': pa.date32(), 'DateTime': pa.timestamp('us'), 'Boolean': pa.bool_()}
+        schema = pa.schema([(column.name, types.get(type(column.type).__name__, pa.string())) for column in COLUMNS])
+        sink = _ChunkSink()
+        writer = pq.ParquetWriter(sink, schema)
+        try:
+            for rows in self.partitions():
+                columns = list(zip(*rows))
+                writer.write_table(pa.Table.from_arrays(
+                    [pa.array(values, type=field.type) for values, field in zip(columns, schema)], schema=schema
+                ))
+                yield sink.drain()
+        finally:
+            writer.close()
+        yield sink.drain()
+
+    def chunks(self, export_format: str) -> Iterator[bytes]:
+        if export_format == 'parquet':
+            return self.parquet_chunks()
+        if export_format == 'jsonl':
+            return self.jsonl_chunks()
+        return self.csv_chunks()
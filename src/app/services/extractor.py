@@ -0,0 +1,75 @@
+import re
+from datetime import date, datetime
+from typing import Optional
+from ..settings import LOGGER
+
+# Префикс вида "ИНН: " перед значением в ячейке реквизитов
+INN_PREFIX = re.compile(r'^\w+:\s*')
+
+
+def parse_date(value: str) -> date:
+    """ Разбираем дату формата dd.mm.yyyy без datetime.strptime """
+    if len(value) == 10 and value[2] == '.' and value[5] == '.':
+        try:
+            return date(int(value[6:10]), int(value[3:5]), int(value[0:2]))
+        except ValueError:
+            pass
+    # Нестандартную запись отдаём strptime, чтобы получить ту же ошибку, что и раньше
+    return datetime.strptime(value, "%d.%m.%Y").date()
+
+
+def _first_text(cell) -> str:
+    """ Первый текстовый узел ячейки - аналог td/text()[0] """
+    if cell.text is not None:
+        return cell.text
+    for child in cell:
+        if child.tail is not None:
+            return child.tail
+    raise ValueError('Empty table cell')
+
+
+class RowExtractor:
+    """ Класс извлечения данных компании из строки таблицы реестра ФАС за один проход по ячейкам """
+
+    # Порядковые номера колонок таблицы ФАС (с нуля)
+    REGISTRY, SECTION, DOC_NUMBER, REGION, COMPANY_NAME, REQUISITES, ADDRESS, ORDER_NUMBER, ORDER_DATE = range(9)
+
+    def _get_inn(self, cell) -> Optional[str]:
+        """ Извлекаем ИНН из блока nobr/div ячейки реквизитов """
+        for nobr in cell:
+            if nobr.tag != 'nobr':
+                continue
+            for div in nobr:
+                if div.tag == 'div' and div.text is not None and 'ИНН' in div.text:
+                    return INN_PREFIX.sub('', div.text, count=1)
+        return None
+
+    def extract(self, row) -> Optional[dict]:
+        """
+        Извлекаем данные компании из строки <tr>.
+        Возвращаем None, если строку нужно пропустить, ValueError - если строка не соответствует формату таблицы
+        """
+        cells = [cell for cell in row if cell.tag == 'td']
+        if len(cells) <= self.ORDER_DATE:
+            raise ValueError('Unexpected number of table cells: %s' % len(cells))
+
+        inn = self._get_inn(cells[self.REQUISITES])
+        # Пропускаем строку в таблице, если в поле где должен быть ИНН - пусто
+        if inn is None:
+            return None
+
+        # Проверяем что ИНН похож на правильный
+        if len(inn) != 10 and len(inn) != 12:
+            LOGGER.info(f'Error len INN != 10 or != 12 {inn}')
+            return None
+
+        return {
+            'inn': inn,
+            'companyName': _first_text(cells[self.COMPANY_NAME]),
+            'registry': _first_text(cells[self.REGISTRY]),
+            'section': _first_text(cells[self.SECTION]),
+            'docNumber': _first_text(cells[self.DOC_NUMBER]),
+            'region': _first_text(cells[self.REGION]),
+            'address': _first_text(cells[self.ADDRESS]),
+            'dateFirstReg': parse_date(_first_text(cells[self.ORDER_DATE])),
+        }
@@ -0,0 +1,143 @@
+import requests
+from typing import Dict, Tuple
+from bs4 import BeautifulSoup
+from fastapi import (HTTPException, status)
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from ..settings import settings, LOGGER
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/98.0.4758.102 Safari/537.36'
+
+TOKEN_HEADERS = {
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.9',
+    'Accept-Encoding': 'gzip, deflate',
+    'Accept-Language': 'ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7',
+    'Cache-Control': 'no-cache',
+    'Connection': 'keep-alive',
+    'Host': 'apps.eias.fas.gov.ru',
+    'Pragma': 'no-cache',
+    'User-Agent': USER_AGENT,
+}
+
+REGISTRY_HEADERS = {
+    'Accept': '*/*',
+    'Accept-Encoding': 'gzip, deflate',
+    'Accept-Language': 'ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7',
+    'Host': 'apps.eias.fas.gov.ru',
+    # 'Origin': 'http://apps.eias.fas.gov.ru',
+    'Referer': 'http://apps.eias.fas.gov.ru/FindCem/',
+    'Cache-Control': 'no-cache',
+    'Connection': 'keep-alive',
+    'Content-Type': 'application/x-www-form-urlencoded; charset=UTF-8',
+    'User-Agent': USER_AGENT,
+    'X-Requested-With': 'XMLHttpRequest',
+}
+
+
+class FasClient:
+    """ Класс получения данных с сайта ФАС через общий пул соединений с таймаутами и повторами """
+
+    def __init__(self):
+        retry = Retry(
+            total=settings.fas_retries,
+            backoff_factor=settings.fas_backoff,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(('GET', 'POST')),
+            raise_on_status=False,
+        )
+        # При загрузке реестра частями соединений должно хватать на все потоки
+        adapter = HTTPAdapter(max_retries=retry,
+                              pool_maxsize=max(settings.fas_pool_size, settings.fas_partition_workers))
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.timeout = (settings.fas_connect_timeout, settings.fas_read_timeout)
+
+    def _exception(self) -> HTTPException:
+        return HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='Error get data from site',
+            headers={'WWW-Authenticate': 'Bearer'},
+        )
+
+    def _get_token_from_cookies(self, cookies: str):
+        """ Получаем токен из cookies """
+        soup = BeautifulSoup(cookies, 'html.parser')
+        el = soup.find("input", {"name": "__RequestVerificationToken"})
+        try:
+            token = el['value']
+        except:
+            return None
+        return token
+
+    def _get_form_options(self, page: str) -> Dict[str, Dict[str, str]]:
+        """ Значения списков RegionID и RegTypeID формы поиска без варианта «все» (0) """
+        soup = BeautifulSoup(page, 'html.parser')
+        options = {}
+        for field in ('RegionID', 'RegTypeID'):
+            select = soup.find('select', {'name': field})
+            if select is None:
+                continue
+            options[field] = {
+                option['value']: option.get_text(strip=True)
+                for option in select.find_all('option') if option.get('value') not in (None, '', '0')
+            }
+        return options
+
+    def _get_page(self) -> str:
+        """ Страница формы поиска, на которой cookies и токен авторизации """
+        try:
+            data = self.session.get(url=settings.cookies_url_fas, headers=TOKEN_HEADERS, timeout=self.timeout)
+        except requests.RequestException as error:
+            LOGGER.info('Error get token from site: %s', error)
+            raise self._exception()
+        if data.status_code != 200:
+            raise self._exception()
+        return data.text
+
+    def get_token(self) -> str:
+        """ Получаем cookies и извлекаем токен авторизации """
+        token = self._get_token_from_cookies(self._get_page())
+        if token is None:
+            raise self._exception()
+        return token
+
+    def get_form(self) -> Tuple[str, Dict[str, Dict[str, str]]]:
+        """ Токен авторизации и значения фильтров формы поиска: {'RegionID': {'77': 'г. Москва', ...}, ...} """
+        page = self._get_page()
+        token = self._get_token_from_cookies(page)
+        if token is None:
+            raise self._exception()
+        return token, self._get_form_options(page)
+
+    def fetch_registry(self, token: str, conditions: dict = None, **filters) -> requests.Response:
+        """
+        Запрашиваем таблицу со списком естественных монополий.
+        Возвращаем ответ, тело которого ещё не прочитано: gzip распаковывается по мере чтения iter_content.
+        conditions - заголовки условного запроса (If-None-Match, If-Modified-Since), при их совпадении ответ 304
+        """
+        # формируем тело запроса для получения списка монополий
+        payload = {
+            '__RequestVerificationToken': token,
+            'RegTypeID': 0,
+            'RegPartID': 0,
+            'RegionID': 0,
+            'OrgName': '',
+            'INN': '',
+            'OKPO': '',
+            'OGRN': '',
+            **filters,
+        }
+        try:
+            data = self.session.post(url=settings.url_fas, headers={**REGISTRY_HEADERS, **(conditions or {})},
+                                     data=payload, timeout=self.timeout, stream=True)
+        except requests.RequestException as error:
+            LOGGER.info('Error get data from site: %s', error)
+            raise self._exception()
+        if data.status_code not in (200, 304):
+            data.close()
+            raise self._exception()
+        return data
+
+
+fas_client = FasClient()
@@ -0,0 +1,115 @@
+import time
+from datetime import date, datetime, timedelta
+from typing import Iterable, List, Optional
+from sqlalchemy import select
+from .. import tables
+
+# Поля версии, которые копируются из записи списка
+VERSION_FIELDS = ('inn', 'companyName', 'registry', 'section', 'docNumber', 'region', 'address', 'dateFirstReg',
+                  'manualUpload')
+
+
+def as_of_query(inn: str, day: date):
+    """
+    Версия компании, действовавшая в день day: период версии пересекается с этим днём.
+    Если данные менялись в течение дня - последняя из версий дня
+    """
+    history = tables.MonopolyHistory
+    start = datetime.combine(day, datetime.min.time())
+    return select(history) \
+        .where(history.inn == inn) \
+        .where(history.validFrom < start + timedelta(days=1)) \
+        .where((history.validTo == None) | (history.validTo > start)) \
+        .order_by(history.validFrom.desc()) \
+        .limit(1)
+
+
+def first_valid_from(row: dict, moment: datetime) -> datetime:
+    """ Начало первой версии компании: дата включения в реестр или, если её нет, момент moment """
+    first = row.get('dateFirstReg')
+    if first is None:
+        return moment
+    return datetime.combine(first, datetime.min.time())
+
+
+class MonopolyHistory:
+    """
+    Класс записи версий списка естественных монополий в monopoly_history.
+    Таблица только дополняется: изменение данных закрывает текущую версию (validTo) и открывает новую
+    """
+
+    def __init__(self, session, chunk_size: int = 1000):
+        self.session = session
+        self.chunk_size = chunk_size
+        self.stats = {'opened': 0, 'closed': 0}
+        self.elapsed = 0.0
+
+    def _insert(self, rows: List[dict], valid_from):
+        """ Открываем версии одним многострочным INSERT; valid_from - начало версии для строки """
+        self.session.execute(tables.MonopolyHistory.__table__.insert(), [
+            {**{field: row.get(field) for field in VERSION_FIELDS}, 'validFrom': valid_from(row), 'validTo': None}
+            for row in rows
+        ])
+        self.stats['opened'] += len(rows)
+
+    def open(self, rows: List[dict], moment: datetime):
+        """
+        Открываем первые версии новых компаний. Как и начальные версии миграции monopoly_history,
+        версия начинается с даты включения в реестр, а если она неизвестна - с момента проверки moment
+        """
+        if not rows:
+            return
+        started = time.perf_counter()
+        self._insert(rows, lambda row: first_valid_from(row, moment))
+        self.elapsed += time.perf_counter() - started
+
+    def close(self, inns: Iterable[str], valid_to: datetime):
+        """ Закрываем текущие версии компаний пачками по chunk_size ИНН """
+        started = time.perf_counter()
+        inns = list(inns)
+        history = tables.MonopolyHistory
+        for position in range(0, len(inns), self.chunk_size):
+            self.stats['closed'] += self.session.query(history) \
+                .filter(history.inn.in_(inns[position:position + self.chunk_size])) \
+                .filter(history.validTo == None) \
+                .update({history.validTo: valid_to}, synchronize_session=False)
+        self.elapsed += time.perf_counter() - started
+
+    def close_removed(self, remove_time: datetime):
+        """ Одним запросом закрываем версии компаний, которым sweep проставил дату исключения remove_time """
+        started = time.perf_counter()
+        history = tables.MonopolyHistory
+        removed = select(tables.Monopoly.inn).where(tables.Monopoly.removeDate == remove_time)
+        self.stats['closed'] += self.session.query(history) \
+            .filter(history.inn.in_(removed)) \
+            .filter(history.validTo == None) \
+            .update({history.validTo: remove_time}, synchronize_session=False)
+        self.elapsed += time.perf_counter() - started
+
+    def _versioned(self, inns: List[str]) -> set:
+        """ ИНН, для которых в monopoly_history уже есть версии """
+        history = tables.MonopolyHistory
+        found = set()
+        for position in range(0, len(inns), self.chunk_size):
+            found.update(self.session.execute(
+                select(history.inn).where(history.inn.in_(inns[position:position + self.chunk_size])).distinct()
+            ).scalars())
+        return found
+
+    def replace(self, rows: List[dict], moment: datetime):
+        """
+        Новые версии для записанных данных: закрываем текущие и открываем новые с момента moment.
+        Для компаний без версий (новые ИНН ручной загрузки) открываем первую версию, как open
+        """
+        if not rows:
+            return
+        started = time.perf_counter()
+        versioned = self._versioned([row['inn'] for row in rows])
+        self.elapsed += time.perf_counter() - started
+        self.close(versioned, moment)
+        started = time.perf_counter()
+        self._insert(rows, lambda row: moment if row['inn'] in versioned else first_valid_from(row, moment))
+        self.elapsed += time.perf_counter() - started
+
+    def as_of(self, inn: str, day: date) -> Optional[tables.MonopolyHistory]:
+        return self.session.execute(as_of_query(inn, day)).scalars().first()
@@ -0,0 +1,188 @@
+from datetime import datetime, timedelta
+from typing import Optional
+from fastapi import (HTTPException, status)
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+from .. import tables
+from ..metrics import Counter
+from ..settings import settings, LOGGER
+
+KIND_REFRESH = 'refresh'
+
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+STATUS_SUCCESS = 'success'
+STATUS_FAILED = 'failed'
+
+REFRESH_JOBS = Counter('fas_refresh_jobs_total', 'Finished refresh jobs by status', ('status',))
+
+# Ключ advisory lock PostgreSQL, которым процессы договариваются, кто обновляет список
+REFRESH_LOCK_KEY = 0x626C706172736572
+
+
+class RefreshLock:
+    """
+    Блокировка на время обновления списка. В PostgreSQL - pg_try_advisory_lock на отдельном соединении,
+    чтобы из нескольких процессов (воркеров uvicorn, app.worker) обновление выполнял только один.
+    Соединение в режиме AUTOCOMMIT: блокировка сессионная, и открытая транзакция на всё время обновления
+    не нужна (она удерживала бы горизонт xmin и попадала под idle_in_transaction_session_timeout).
+    В других СУБД блокировки нет: acquire возвращает True, held остаётся False
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.connection = None
+        self.held = False
+
+    def acquire(self) -> bool:
+        if self.engine.dialect.name != 'postgresql':
+            return True
+        self.connection = self.engine.connect().execution_options(isolation_level='AUTOCOMMIT')
+        acquired = self.connection.execute(
+            text('SELECT pg_try_advisory_lock(:key)'), {'key': REFRESH_LOCK_KEY}
+        ).scalar()
+        if not acquired:
+            self.release()
+        self.held = bool(acquired)
+        return self.held
+
+    def release(self):
+        if self.connection is None:
+            return
+        try:
+            self.connection.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': REFRESH_LOCK_KEY})
+        finally:
+            self.connection.close()
+            self.connection = None
+            self.held = False
+
+
+class RefreshJobs:
+    """ Класс очереди заданий на обновление списка естественных монополий с сайта ФАС """
+
+    def __init__(self, session):
+        self.session = session
+
+    def get(self, job_id: int) -> tables.MonopolyRefresh:
+        job = self.session.query(tables.MonopolyRefresh).get(job_id)
+        if job is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Job not found')
+        return job
+
+    def _active(self) -> Optional[tables.MonopolyRefresh]:
+        """ Задание, которое ещё ожидает выполнения или выполняется """
+        return self.session.query(tables.MonopolyRefresh) \
+            .filter(tables.MonopolyRefresh.kind == KIND_REFRESH) \
+            .filter(tables.MonopolyRefresh.status.in_((STATUS_QUEUED, STATUS_RUNNING))) \
+            .order_by(tables.MonopolyRefresh.id) \
+            .first()
+
+    def enqueue(self) -> tables.MonopolyRefresh:
+        """
+        Ставим обновление в очередь. Если задание уже ждёт или выполняется - возвращаем его.
+        Второе активное задание не даёт вставить уникальный индекс ix__monopoly_refresh__kind_active
+        """
+        while True:
+            job = self._active()
+            if job is not None:
+                return job
+            job = tables.MonopolyRefresh(kind=KIND_REFRESH, status=STATUS_QUEUED, createdAt=datetime.now())
+            self.session.add(job)
+            try:
+                self.session.commit()
+                return job
+            except IntegrityError:
+                # Задание одновременно поставил другой процесс - возвращаем его
+                self.session.rollback()
+
+    def _is_due(self) -> bool:
+        """ С момента постановки последнего задания прошло больше scheduler_period """
+        last = self.session.query(tables.MonopolyRefresh.createdAt) \
+            .filter(tables.MonopolyRefresh.kind == KIND_REFRESH) \
+            .order_by(tables.MonopolyRefresh.id.desc()) \
+            .limit(1) \
+            .scalar()
+        return last is None or last <= datetime.now() - timedelta(seconds=settings.scheduler_period)
+
+    def has_pending(self) -> bool:
+        """
+        Есть ли работа для run_pending: задание ждёт или выполняется, или подошёл срок планового обновления.
+        Проверяется без блокировки, чтобы опрос в каждом воркере API не открывал соединение для advisory lock
+        """
+        return self._active() is not None or self._is_due()
+
+    def _claim(self, job_id: int) -> bool:
+        """ Переводим задание в running, только если его ещё не взял другой процесс """
+        claimed = self.session.query(tables.MonopolyRefresh) \
+            .filter(tables.MonopolyRefresh.id == job_id) \
+            .filter(tables.MonopolyRefresh.status == STATUS_QUEUED) \
+            .update({
+                tables.MonopolyRefresh.status: STATUS_RUNNING,
+                tables.MonopolyRefresh.startedAt: datetime.now(),
+            }, synchronize_session=False)
+        self.session.commit()
+        return claimed == 1
+
+    def _run(self, job: tables.MonopolyRefresh):
+        """ Выполняем задание и фиксируем его результат. False - задание уже взял другой процесс """
+        job_id = job.id
+        if not self._claim(job_id):
+            return False
+        job = self.session.query(tables.MonopolyRefresh).get(job_id)
+
+        LOGGER.info("Start parsing ----------------------- job %s", job_id)
+        try:
+            # Разбор страницы ФАС (requests, bs4, lxml) загружается только в процессе, который выполняет обновление
+            from .parser import MonopolyParser
+            MonopolyParser(self.session).parser_monopoly(job)
+            REFRESH_JOBS.inc(status=STATUS_SUCCESS)
+        except Exception as error:
+            self.session.rollback()
+            detail = getattr(error, 'detail', None) or repr(error)
+            LOGGER.info('Refresh job %s failed: %s', job_id, detail)
+            job = self.session.query(tables.MonopolyRefresh).get(job_id)
+            job.status = STATUS_FAILED
+            job.error = str(detail)[:512]
+            job.finishedAt = datetime.now()
+            self.session.commit()
+            REFRESH_JOBS.inc(status=STATUS_FAILED)
+        LOGGER.info("End parsing ------------------------- job %s", job_id)
+        return True
+
+    def run_pending(self, engine) -> int:
+        """
+        Ставим плановое обновление, если подошёл срок, и выполняем задания из очереди.
+        Возвращаем количество выполненных заданий (0 - если обновление выполняет другой процесс)
+        """
+        if not self.has_pending():
+            return 0
+        lock = RefreshLock(engine)
+        if not lock.acquire():
+            return 0
+        done = 0
+        try:
+            if lock.held:
+                # Задание, оставшееся в статусе running после остановки процесса, выполняем заново.
+                # Без блокировки так делать нельзя: его может выполнять другой процесс
+                self.session.query(tables.MonopolyRefresh) \
+                    .filter(tables.MonopolyRefresh.status == STATUS_RUNNING) \
+                    .update({tables.MonopolyRefresh.status: STATUS_QUEUED}, synchronize_session=False)
+                self.session.commit()
+
+            if self._is_due():
+                self.enqueue()
+
+            while True:
+                job = self.session.query(tables.MonopolyRefresh) \
+                    .filter(tables.MonopolyRefresh.kind == KIND_REFRESH) \
+                    .filter(tables.MonopolyRefresh.status == STATUS_QUEUED) \
+                    .order_by(tables.MonopolyRefresh.id) \
+                    .first()
+                if job is None:
+                    break
+                # Задание, которое уже взял другой процесс, пропускаем
+                if self._run(job):
+                    done += 1
+        finally:
+            lock.release()
+        return done
@@ -0,0 +1,180 @@
+import mmap, os, struct, tempfile, time
+from array import array
+from bisect import bisect_left
+from typing import Optional
+import orjson
+from sqlalchemy import func
+from .. import tables
+from .cache import MISSING
+from ..settings import settings, LOGGER
+
+# Формат файла (порядок байт машины, на которой он записан):
+#
+#   заголовок - HEADER
+#   записи    - данные компаний в JSON подряд (orjson, байты совпадают с телом ответа monopoly_check)
+#   ключи     - count x u64, ИНН по возрастанию (inn_key), с границы 8 байт
+#   границы   - count x 2 x u64, начало и конец записи компании
+#   флаги     - count x u8, ACTIVE
+#
+# Заголовок: сигнатура с версией формата, метка порядка байт, резерв, номер обновления списка
+# (MonopolyRefresh.id, -1 - неизвестен), количество записей и смещение массива ключей
+MAGIC = b'BLMONO01'
+BYTE_ORDER = 0x01020304
+HEADER = struct.Struct('=8sIIqQQ')
+
+# Признак записи в массиве флагов: компания в текущем списке (removeDate IS NULL)
+ACTIVE = 1
+
+
+def inn_key(inn: str) -> Optional[int]:
+    """ ИНН в виде числа: длина в старшем байте, чтобы ИНН с ведущими нулями не совпадали. None - не цифры """
+    if not inn or not (inn.isascii() and inn.isdigit()) or len(inn) > 16:
+        return None
+    return len(inn) << 56 | int(inn)
+
+
+def _align(file, size: int = 8):
+    """ Дополняем файл нулями до границы size байт, чтобы массивы читались через memoryview.cast """
+    file.write(b'\0' * (-file.tell() % size))
+
+
+def write_lookup_file(session, path: str, version: Optional[int] = None) -> int:
+    """
+    Записываем файл поиска по ИНН из таблицы monopoly. Файл пишется рядом с path и подменяется
+    через os.replace, поэтому читатели видят либо предыдущую версию, либо новую целиком.
+    Возвращаем количество записей
+    """
+    started = time.perf_counter()
+    table = tables.Monopoly.__table__
+    # Для ИНН из цифр порядок (длина, строка) совпадает с порядком ключей inn_key
+    query = table.select().order_by(func.length(table.c.inn), table.c.inn).execution_options(stream_results=True)
+    keys, spans, flags = array('Q'), array('Q'), bytearray()
+    directory = os.path.dirname(os.path.abspath(path))
+    descriptor, temporary = tempfile.mkstemp(dir=directory, prefix='.lookup-', suffix='.tmp')
+    try:
+        with os.fdopen(descriptor, 'wb') as file:
+            file.write(b'\0' * HEADER.size)
+            for company in session.execute(query).mappings():
+                key = inn_key(company['inn'])
+                if key is None:
+                    # Такие ИНН проверяются по базе
+                    continue
+                record = orjson.dumps(dict(company))
+                keys.append(key)
+                spans.append(file.tell())
+                file.write(record)
+                spans.append(file.tell())
+                flags.append(ACTIVE if company['removeDate'] is None else 0)
+            if any(keys[number] > keys[number + 1] for number in range(len(keys) - 1)):
+                # Порядок сортировки строк зависит от collation базы - упорядочиваем ключи сами
+                order = sorted(range(len(keys)), key=keys.__getitem__)
+                keys = array('Q', (keys[number] for number in order))
+                spans = array('Q', (spans[2 * number + shift] for number in order for shift in (0, 1)))
+                flags = bytearray(flags[number] for number in order)
+            _align(file)
+            keys_offset = file.tell()
+            keys.tofile(file)
+            spans.tofile(file)
+            file.write(flags)
+            file.seek(0)
+            file.write(HEADER.pack(MAGIC, BYTE_ORDER, 0, -1 if version is None else version, len(keys), keys_offset))
+            file.flush()
+            os.fsync(file.fileno())
+        # mkstemp создаёт файл с правами 0600, а файл читают и пакетные задачи
+        os.chmod(temporary, 0o644)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+    LOGGER.info('Lookup file written: %s, %s rows in %.3f s', path, len(keys), time.perf_counter() - started)
+    return len(keys)
+
+
+class LookupFile:
+    """
+    Файл поиска по ИНН, открытый через mmap только для чтения. Страницы файла общие для всех процессов,
+    которые его открыли; поиск - двоичный поиск по массиву ключей без копирования и без запросов к базе
+    """
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as file:
+            stat = os.fstat(file.fileno())
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        # Файл с тем же inode, временем изменения и размером повторно не открывается
+        self.identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        magic, byte_order, _, version, count, keys_offset = HEADER.unpack_from(self.map)
+        if magic != MAGIC or byte_order != BYTE_ORDER:
+            raise ValueError(f'{path} is not a lookup file of this format')
+        self.version = None if version < 0 else version
+        view = memoryview(self.map)
+        self.keys = view[keys_offset:keys_offset + 8 * count].cast('Q')
+        self.spans = view[keys_offset + 8 * count:keys_offset + 24 * count].cast('Q')
+        self.flags = view[keys_offset + 24 * count:keys_offset + 25 * count]
+
+    def find(self, inn: str, history: bool):
+        """
+        Тело ответа проверки (JSON в байтах) или None - компании нет в списке, как в запросе company_query.
+        MISSING - ИНН не из цифр, его нужно проверить по базе
+        """
+        key = inn_key(inn)
+        if key is None:
+            return MISSING
+        position = bisect_left(self.keys, key)
+        if position == len(self.keys) or self.keys[position] != key:
+            return None
+        if not history and not self.flags[position] & ACTIVE:
+            return None
+        return self.map[self.spans[2 * position]:self.spans[2 * position + 1]]
+
+    def get(self, inn: str, history: bool):
+        """ Данные компании словарём (даты - строками ISO), None или MISSING, как find """
+        record = self.find(inn, history)
+        if record is None or record is MISSING:
+            return record
+        return orjson.loads(record)
+
+    def __len__(self):
+        return len(self.keys)
+
+
+class LookupFileHolder:
+    """
+    Файл поиска текущего процесса. Раз в lookup_file_check_interval секунд проверяем stat файла:
+    после замены файла новой версией (другой inode) открываем её, старая закрывается вместе с последней ссылкой
+    """
+
+    def __init__(self):
+        self.file: Optional[LookupFile] = None
+        self.checked = None
+
+    def invalidate(self):
+        """ Проверить файл при следующем обращении (после обновления списка) """
+        self.checked = None
+
+    def get(self) -> Optional[LookupFile]:
+        if not settings.lookup_file:
+            return None
+        now = time.monotonic()
+        if self.checked is None or now - self.checked >= settings.lookup_file_check_interval:
+            self.checked = now
+            self._reopen()
+        return self.file
+
+    def _reopen(self):
+        try:
+            stat = os.stat(settings.lookup_file)
+        except OSError:
+            self.file = None
+            return
+        if self.file is not None and self.file.identity == (stat.st_ino, stat.st_mtime_ns, stat.st_size):
+            return
+        try:
+            self.file = LookupFile(settings.lookup_file)
+        except (OSError, ValueError) as error:
+            LOGGER.info('Error open lookup file: %s', error)
+            self.file = None
+            return
+        LOGGER.info('Lookup file opened: version %s, %s rows', self.file.version, len(self.file))
+
+
+lookup_file = LookupFileHolder()
@@ -1,276 +1,272 @@
-import re, io
-import pylightxl as xl
+import orjson
+from itertools import islice
+from typing import AsyncIterator, Iterable, List, Optional, Tuple
 from fastapi import (HTTPException, status)
-from datetime import datetime
-from requests import Session as Session_request
-from bs4 import BeautifulSoup
-from lxml import etree
+from datetime import date
+from sqlalchemy import select
 from .. import tables
+from ..metrics import Counter, Gauge, Histogram
+from .cache import LRUCache, MISSING
+from .history import as_of_query
+from .lookup_file import lookup_file, write_lookup_file
+from .search import search_index
+from .snapshot import registry_snapshot
 from ..settings import settings, LOGGER
 
+# Кэш результатов проверки по ключу (inn, history), включая отрицательные ответы
+monopoly_cache = LRUCache(maxsize=settings.cache_size, ttl=settings.cache_ttl)
+# Готовые тела ответов monopoly_check (JSON в байтах, None - компании нет) по ключу (inn, history, as_of)
+response_cache = LRUCache(maxsize=settings.cache_size, ttl=settings.cache_ttl)
+
+
+REFRESH_PHASE_SECONDS = Histogram(
+    'fas_refresh_phase_seconds', 'Duration of FAS refresh phases', ('phase',),
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0),
+)
+REFRESH_ROWS = Counter('fas_refresh_rows_total', 'Registry rows processed by FAS refreshes', ('kind',))
+REFRESH_LAST_ROWS = Gauge('fas_refresh_last_rows', 'Registry rows processed by the last successful refresh', ('kind',))
+REFRESH_LAST_SUCCESS = Gauge('fas_refresh_last_success_timestamp_seconds', 'Unix time of the last successful refresh')
+
+for _name in ('size', 'hits', 'misses', 'evictions'):
+    Gauge(f'monopoly_cache_{_name}', f'monopoly_check cache {_name}').set_function(
+        lambda name=_name: monopoly_cache.stats()[name])
+
+
+# Последнее успешное обновление, данные которого видит этот процесс
+_read_path_version = None
+
+
+def registry_version(session):
+    """ Номер последнего успешного обновления списка (с сайта ФАС или ручной загрузкой) """
+    return session.query(tables.MonopolyRefresh.id) \
+        .filter(tables.MonopolyRefresh.status == 'success') \
+        .order_by(tables.MonopolyRefresh.id.desc()) \
+        .limit(1) \
+        .scalar()
+
+
+def refresh_read_path(session):
+    """
+    После фиксации новых данных подменяем снимок списка в памяти и индекс поиска, затем сбрасываем кэш.
+    Новый ETag публикуем последним: пока снимок и индекс строятся, ответы и ETag относятся к прежней версии
+    """
+    global _read_path_version
+    version = registry_version(session)
+    if settings.snapshot_enabled:
+        registry_snapshot.reload(session)
+    # Индекс поиска строится после снимка, чтобы использовать его строки; без search_preload - в фоновом потоке
+    if settings.search_preload:
+        search_index.reload(session)
+    else:
+        search_index.refresh()
+    monopoly_cache.clear()
+    response_cache.clear()
+    # Файл поиска по ИНН мог заменить процесс, выполнивший обновление, - проверяем его при следующей проверке
+    lookup_file.invalidate()
+    _read_path_version = version
+
+
+def sync_read_path(session):
+    """ Обновляем кэш и снимок, если список обновил другой процесс (app.worker или другой воркер uvicorn) """
+    if registry_version(session) != _read_path_version:
+        refresh_read_path(session)
+
+
+def publish_lookup_file(session, force: bool = True):
+    """
+    Записываем файл поиска по ИНН для версии списка, которую видит процесс: после обновления списка
+    или (force=False) при запуске, если файла нет или он записан для другой версии
+    """
+    if not settings.lookup_file:
+        return
+    if not force:
+        current = lookup_file.get()
+        if current is not None and current.version == _read_path_version:
+            return
+    try:
+        write_lookup_file(session, settings.lookup_file, _read_path_version)
+    except Exception:
+        # Список уже зафиксирован, поэтому обновление не считается неудачным: прежний файл записан
+        # для другой версии и не используется, проверки идут через снимок и базу до следующей записи файла
+        LOGGER.exception('Error write lookup file %s', settings.lookup_file)
+        return
+    lookup_file.invalidate()
+
+
+def registry_etag() -> Optional[str]:
+    """ ETag ответов проверки - номер последнего успешного обновления, данные которого видит этот процесс """
+    if _read_path_version is None:
+        return None
+    return f'"registry-{_read_path_version}"'
+
+
+def encode(company: Optional[dict]) -> Optional[bytes]:
+    """ Тело ответа проверки; orjson сериализует даты так же, как jsonable_encoder (isoformat) """
+    if company is None:
+        return None
+    return orjson.dumps(company)
+
+
+def to_dict(company) -> dict:
+    """ Копируем значения полей записи (Monopoly или MonopolyHistory), чтобы хранить их в кэше независимо от сессии """
+    return {column.name: getattr(company, column.name) for column in company.__table__.columns}
+
+
+def company_query(inn: str, history: bool):
+    """ Запрос компании по ИНН """
+    query = select(tables.Monopoly).where(tables.Monopoly.inn == inn)
+    if not history:
+        # проверяем сейчас есть в списке монополий
+        query = query.where(tables.Monopoly.removeDate == None)
+    return query.limit(1)
+
+
+def _companies_query(inns: List[str], history: bool):
+    """ Запрос пачки ИНН одним IN (...) """
+    query = select(tables.Monopoly).where(tables.Monopoly.inn.in_(inns))
+    if not history:
+        query = query.where(tables.Monopoly.removeDate == None)
+    return query
+
+
+def _current_lookup_file():
+    """ Файл поиска, записанный для версии списка, которую видит процесс. None - файл не используется """
+    current = lookup_file.get()
+    if current is None or current.version != _read_path_version:
+        # Файл ещё не переписан после обновления (или его запись не удалась) - его данные устарели
+        return None
+    return current
+
+
+def _lookup_file(inn: str, history: bool):
+    """ Ищем компанию в файле поиска по ИНН. MISSING - файл не используется или ИНН нужно проверить по базе """
+    current = _current_lookup_file()
+    if current is None:
+        return MISSING
+    return current.get(inn, history)
+
+
+def _encoded_from_file(inn: str, history: bool, as_of: Optional[date]):
+    """ Тело ответа проверки прямо из файла поиска, без разбора и повторной сериализации """
+    current = _current_lookup_file()
+    if current is None or as_of is not None:
+        return MISSING
+    return current.find(inn, history)
+
+
+def _lookup_cached(inn: str, history: bool):
+    """ Ищем компанию в файле поиска, в снимке в памяти или в кэше. MISSING - нужно обратиться к базе """
+    company = _lookup_file(inn, history)
+    if company is not MISSING:
+        return company
+    snapshot = registry_snapshot.snapshot
+    if settings.snapshot_enabled and snapshot is not None:
+        # Отвечаем из снимка в памяти, не обращаясь к базе
+        return snapshot.get(inn, history)
+    return monopoly_cache.get((inn, history))
+
+
+def _lookup_chunk_cached(chunk: List[str], history: bool) -> Tuple[dict, List[str]]:
+    """
+    Ищем пачку ИНН в файле поиска, в снимке или в кэше.
+    Возвращаем найденное и список ИНН, которые нужно запросить из базы
+    """
+    snapshot = registry_snapshot.snapshot
+    if settings.snapshot_enabled and snapshot is not None and _current_lookup_file() is None:
+        return {inn: snapshot.get(inn, history) for inn in chunk}, []
+    found = {}
+    for inn in chunk:
+        company = _lookup_cached(inn, history)
+        if company is not MISSING:
+            found[inn] = company
+    return found, list({inn for inn in chunk if inn not in found})
+
+
+def _store_chunk(found: dict, missed: List[str], companies: dict, history: bool):
+    """ Дополняем результат ответом базы и сохраняем его в кэш, включая отсутствующие ИНН """
+    for inn in missed:
+        found[inn] = companies.get(inn)
+        monopoly_cache.set((inn, history), found[inn])
+
 
-class Monopoly:
-    """ Класс проверки наличия компании в списке монополий (в нашей базе) """
-
-    def __init__(self, session):
-        self.session = session
-
-    def _get(self, inn: str, history: bool):
-        """ Проверяем (в нашей базе) наличие компании в списке монополий """
-        if history:
-            # проверяем была ли компания когла-либо в списке монополий
-            return self.session.query(tables.Monopoly) \
-                .filter(tables.Monopoly.inn == inn, ) \
-                .first()
-        else:
-            # проверяем сейчас есть в списке монополий
-            return self.session.query(tables.Monopoly) \
-                .filter(tables.Monopoly.inn == inn) \
-                .filter(tables.Monopoly.removeDate == None) \
-                .first()
-
-    def get(self, inn: str, history: bool) -> tables.Monopoly:
-        """ Основной метод проверки наличие компании в списке монополий """
-        company = self._get(inn, history)
-        if company is None:
-            raise HTTPException(status.HTTP_404_NOT_FOUND)
-        else:
-            return company
+def _not_found() -> HTTPException:
+    return HTTPException(status.HTTP_404_NOT_FOUND)
 
 
-class MonopolyParser:
-    """ Класс парсинга данных с сайта ФАС - списка естественных монополий """
+class AsyncMonopoly:
+    """
+    Класс проверки наличия компании в списке монополий (в нашей базе).
+    Проверки выполняются в event loop без занятия потока из пула
+    """
 
     def __init__(self, session):
         self.session = session
 
-    def _get_token_from_cookies(self, cookies: str):
-        """ Получаем токен из cookies """
-        soup = BeautifulSoup(cookies, 'html.parser')
-        el = soup.find("input", {"name": "__RequestVerificationToken"})
-        try:
-            token = el['value']
-        except:
-            return None
-        return token
-
-    def _get_monopoly_data(self):
-        """ Получаем данные с сайта ФАС """
-        session_requests = Session_request()
-        exception = HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail='Error get data from site',
-            headers={'WWW-Authenticate': 'Bearer'},
-        )
-        headers1 = {
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.9',
-            'Accept-Encoding': 'gzip, deflate',
-            'Accept-Language': 'ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7',
-            'Cache-Control': 'no-cache',
-            'Connection': 'keep-alive',
-            'Host': 'apps.eias.fas.gov.ru',
-            'Pragma': 'no-cache',
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/98.0.4758.102 Safari/537.36',
-        }
-
-        # Получаем cookies и извлекаем токен авторизации
-        data = session_requests.get(url=settings.cookies_url_fas, headers=headers1)
-        if data.status_code != 200:
-            raise exception
-        token = self._get_token_from_cookies(data.text)
-        if token is None:
-            raise exception
-
-        # формируем тело и заголовки запроса для получения списка монополий
-        payload = {
-            '__RequestVerificationToken': token,
-            'RegTypeID': 0,
-            'RegPartID': 0,
-            'RegionID': 0,
-            'OrgName': '',
-            'INN': '',
-            'OKPO': '',
-            'OGRN': '',
-        }
-        headers2 = {
-            'Accept': '*/*',
-            'Accept-Encoding': 'gzip, deflate',
-            'Accept-Language': 'ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7',
-            'Host': 'apps.eias.fas.gov.ru',
-            # 'Origin': 'http://apps.eias.fas.gov.ru',
-            'Referer': 'http://apps.eias.fas.gov.ru/FindCem/',
-            'Cache-Control': 'no-cache',
-            'Connection': 'keep-alive',
-            'Content-Type': 'application/x-www-form-urlencoded; charset=UTF-8',
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/98.0.4758.102 Safari/537.36',
-            'X-Requested-With': 'XMLHttpRequest',
-        }
-
-        # Получаем таблицу со списком естественных монополий
-        data = session_requests.post(url=settings.url_fas, headers=headers2, data=payload)
-        if data.status_code != 200:
-            raise exception
-        return data.text
-
-    def parser_monopoly(self):
-        """ Основной метод парсинга данных с сайта ФАС - списка естественных монополий """
-
-        # Фиксируем начало процесса
-        start_time = datetime.now()
-
-        exception = HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail='Error parse data',
-            headers={'WWW-Authenticate': 'Bearer'},
-        )
-
-        # Получаем данные с сайта ФАС
-        data = self._get_monopoly_data()
-
-        # Извлекаем табличный список
-        htmlparser = etree.HTMLParser()
-        tree = etree.fromstring(data, htmlparser)
-        all_data_list = tree.xpath('//tbody/tr')
-
-        # Проверяем, что получили данные (в списке должно быть более 1000 записей)
-        if len(all_data_list) < 1000:
-            LOGGER.info('Resive data not containt >1000 items')
-            raise exception
-
-        # Обрабатываем список
-        for number, item in enumerate(all_data_list):
-            try:
-                company_name = item.xpath('.//td[5]/text()')[0]
-                registry = item.xpath('.//td[1]/text()')[0]
-                section = item.xpath('.//td[2]/text()')[0]
-                doc_number = item.xpath('.//td[3]/text()')[0]
-                region = item.xpath('.//td[4]/text()')[0]
-                address = item.xpath('.//td[7]/text()')[0]
-                # order_number = item.xpath('.//td[8]/text()')[0]
-                order_date = item.xpath('.//td[9]/text()')[0]
-                inn_raw = item.xpath('.//td[6]/nobr/div[contains(text(), "ИНН")]/text()')
-            except:
-                LOGGER.info('Error parse items - number s%', str(number))
-                raise exception
-
-            # Пропускаем строку в таблице, если в поле где должен быть ИНН - пусто
-            if len(inn_raw) == 0:
-                continue
-
-            # Извлекаем ИНН
-            try:
-                inn = re.sub(re.compile(r'(^\w+:\s*)'), '', inn_raw[0])
-            except:
-                LOGGER.info('Error get INN - number s%', str(number))
-                raise exception
-
-            # Проверяем что ИНН похож на правильный
-            if ((len(inn) == 10) | (len(inn) == 12)) is False:
-                LOGGER.info(f'Error len INN != 10 or != 12 {inn}')
-                continue
-
-            # Формируем данные для записи в базу
-            full_fas_dict = {
-                'inn': inn,
-                'companyName': company_name,
-                'registry': registry,
-                'section': section,
-                'docNumber': doc_number,
-                'region': region,
-                'address': address,
-                'dateFirstReg': datetime.strptime(order_date, "%d.%m.%Y").date(),
-                'lastCheck': datetime.now()
-            }
-            LOGGER.debug('Parse company: %s ', full_fas_dict)
-
-            # ИНН ранее был в базе ?
-            if (self.session.query(tables.Monopoly)
-                    .filter(tables.Monopoly.inn == inn)
-                    .first()) is None:
-                # ИНН новый, добавляем запись в базу
-                self.session.add(tables.Monopoly(**full_fas_dict))
-                self.session.commit()
+    async def _scalars(self, query) -> list:
+        result = await self.session.execute(query)
+        return result.scalars().all()
+
+    async def _get(self, inn: str, history: bool):
+        companies = await self._scalars(company_query(inn, history))
+        return companies[0] if companies else None
+
+    async def _get_many(self, inns: List[str], history: bool) -> dict:
+        return {company.inn: to_dict(company) for company in await self._scalars(_companies_query(inns, history))}
+
+    async def lookup(self, inn: str, history: bool) -> Optional[dict]:
+        """ Ищем компанию в снимке в памяти, в кэше или в базе. None - компании нет в списке """
+        company = _lookup_cached(inn, history)
+        if company is MISSING:
+            company = await self._get(inn, history)
+            if company is not None:
+                company = to_dict(company)
+            monopoly_cache.set((inn, history), company)
+        return company
+
+    async def lookup_many(self, inns: Iterable[str], history: bool) -> AsyncIterator[Tuple[str, Optional[dict]]]:
+        """ Проверяем список ИНН пачками, сохраняя порядок входных данных """
+        inns = iter(inns)
+        while True:
+            chunk = list(islice(inns, settings.batch_chunk_size))
+            if not chunk:
+                return
+            found, missed = _lookup_chunk_cached(chunk, history)
+            if missed:
+                _store_chunk(found, missed, await self._get_many(missed, history), history)
+            for inn in chunk:
+                yield inn, found[inn]
+
+    async def lookup_as_of(self, inn: str, day: date) -> Optional[dict]:
+        """ Версия данных компании из monopoly_history на дату day. None - в этот день компании не было в списке """
+        company = monopoly_cache.get((inn, day))
+        if company is MISSING:
+            companies = await self._scalars(as_of_query(inn, day))
+            company = to_dict(companies[0]) if companies else None
+            monopoly_cache.set((inn, day), company)
+        return company
+
+    async def get_encoded(self, inn: str, history: bool, as_of: date = None) -> Optional[bytes]:
+        """ Ответ проверки готовыми байтами JSON: сериализуем данные компании один раз до обновления списка """
+        body = _encoded_from_file(inn, history, as_of)
+        if body is not MISSING:
+            return body
+        key = (inn, history, as_of)
+        body = response_cache.get(key)
+        if body is MISSING:
+            if as_of is not None:
+                company = await self.lookup_as_of(inn, as_of)
             else:
-                # ИНН уже есть, обновляем дату последней проверки
-                self.session.query(tables.Monopoly) \
-                    .filter(tables.Monopoly.inn == inn) \
-                    .update({tables.Monopoly.lastCheck: datetime.now()})
-                self.session.commit()
-
-        # Для всех записей, которые "пропали" при очередной проверке - фиксируем текущую дату
-        self.session.query(tables.Monopoly) \
-            .filter(tables.Monopoly.lastCheck < start_time) \
-            .filter(tables.Monopoly.removeDate == None) \
-            .filter(tables.Monopoly.manualUpload != True) \
-            .update({tables.Monopoly.removeDate: datetime.now()})
-        self.session.commit()
-
-        return "Update monopoly list successfully"
-
-    def monopoly_upload(self, file):
-        """ Метод ручной загрузки списка естественных монополий из файла Excel """
-
-        exception = HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail='Error parse data',
-            headers={'WWW-Authenticate': 'Bearer'},
-        )
-
-        # Преобразует передаваемый файл из буфера памяти в читаемый файл для дальнейшей обработки
-        to_excel = io.BytesIO()
-        to_excel.write(file)
-        to_excel.seek(0)
-
-        # Считываем данные файла
-        excel = xl.readxl(to_excel)
-
-        # Список заголовков базы данных для проверки корректности наименований в файле excel
-        db_fields = ['inn', 'companyName', 'registry', 'section', 'docNumber', 'region', 'address', 'dateFirstReg',
-                     'manualUpload']
-
-        # Циклом проходим по строкам файла и формируем словарь для записи в базу данных.
-        # В случае отсутствия какой либо колонки в файле, структура не изменится поскольку задаётся словарём.
-        # На месте отсутствующих значений будет записан null
-        # Если отсутствует ИНН выполнение остановится с ошибкой
-        excel_header = {}
-        for col in excel.ws(excel.ws_names[0]).cols:
-            if col[0] in db_fields:
-                excel_header[col[0]] = col[0]
-            else:
-                LOGGER.info('Incorrect headers in excel file')
-                raise exception
-        excel_header['manualUpload'] = True
-
-        for row in excel.ws(excel.ws_names[0]).rows:
-            row.append(True)
-            if (row != list(excel_header.values())):
-
-                for i, key in enumerate(excel_header):
-                    if key == 'dateFirstReg':
-                        excel_header[key] = datetime.strptime(row[i], "%d.%m.%Y").date()
-                    else:
-                        excel_header[key] = row[i]
-
-                inn = excel_header['inn']
-
-                if excel_header['inn'] != "":
-                    # Проверяем что ИНН похож на правильный
-                    if ((len(str(inn)) == 10) | (len(str(inn)) == 12)) is False:
-                        LOGGER.info(f'Error len INN != 10 or != 12 {inn}')
-                        continue
-
-                    if (self.session.query(tables.Monopoly)
-                            .filter(tables.Monopoly.inn == str(inn))
-                            .first()) is None:
-                        self.session.add(tables.Monopoly(**excel_header))
-                        self.session.commit()
-                    else:
-                        self.session.query(tables.Monopoly) \
-                            .filter(tables.Monopoly.inn == str(inn)) \
-                            .update({**excel_header})
-                        self.session.commit()
-                else:
-                    LOGGER.info('Blank INN field')
-                    raise exception
-
-        return HTTPException(status_code=200, detail="Upload success")
+                company = await self.lookup(inn, history)
+            body = encode(company)
+            response_cache.set(key, body)
+        return body
+
+    async def get(self, inn: str, history: bool, as_of: date = None) -> dict:
+        """ Основной метод проверки наличие компании в списке монополий """
+        if as_of is not None:
+            company = await self.lookup_as_of(inn, as_of)
+        else:
+            company = await self.lookup(inn, history)
+        if company is None:
+            raise _not_found()
+        return company
@@ -0,0 +1,89 @@
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import IO, Iterator, List, Optional, Tuple
+from lxml import etree
+from .extractor import RowExtractor
+
+# Начало тела таблицы и конец строки в исходных байтах страницы
+TBODY_START = re.compile(rb'<tbody[^>]*>', re.IGNORECASE)
+ROW_END = re.compile(rb'</tr\s*>', re.IGNORECASE)
+
+# Поля компании в порядке значений кортежей, которые возвращает extract_fragment
+COLUMNS = ('inn', 'companyName', 'registry', 'section', 'docNumber', 'region', 'address', 'dateFirstReg')
+
+# Обёртка фрагмента, чтобы строки разбирались как //tbody/tr
+FRAGMENT_HEAD = b'<html><body><table><tbody>'
+FRAGMENT_TAIL = b'</tbody></table></body></html>'
+
+
+def split_rows(body: IO, fragment_size: int, read_size: int = 1024 * 1024) -> Iterator[bytes]:
+    """
+    Делим тело таблицы на фрагменты примерно по fragment_size байт, каждый из целых строк <tr>...</tr>.
+    Разметка до первого <tbody> (заголовок таблицы) пропускается
+    """
+    buffer = b''
+    started = False
+    for chunk in iter(lambda: body.read(read_size), b''):
+        buffer += chunk
+        if not started:
+            match = TBODY_START.search(buffer)
+            if match is None:
+                # Оставляем конец буфера на случай, если тег разрезан на границе чтения
+                buffer = buffer[-64:]
+                continue
+            buffer = buffer[match.end():]
+            started = True
+        if len(buffer) < fragment_size:
+            continue
+        end = None
+        for end in ROW_END.finditer(buffer, max(0, fragment_size - 64)):
+            break
+        if end is None:
+            continue
+        yield buffer[:end.end()]
+        buffer = buffer[end.end():]
+    if started and buffer:
+        yield buffer
+
+
+def extract_fragment(fragment: bytes, encoding: Optional[str]) -> Tuple[List[tuple], int, Optional[int]]:
+    """
+    Разбираем фрагмент в процессе пула. Возвращаем данные компаний (кортежи в порядке COLUMNS - их дешевле
+    передавать между процессами, чем словари), количество строк //tbody/tr
+    и номер строки фрагмента, которая не соответствует формату таблицы (None - ошибок нет)
+    """
+    parser = etree.HTMLParser(encoding=encoding)
+    root = etree.fromstring(FRAGMENT_HEAD + fragment + FRAGMENT_TAIL, parser)
+    extractor = RowExtractor()
+    companies, seen = [], 0
+    if root is None:
+        return companies, seen, None
+    for row in root.iter('tr'):
+        parent = row.getparent()
+        if parent is None or parent.tag != 'tbody':
+            continue
+        try:
+            company = extractor.extract(row)
+        except ValueError:
+            return companies, seen + 1, seen
+        seen += 1
+        if company is not None:
+            companies.append(tuple(company[column] for column in COLUMNS))
+    return companies, seen, None
+
+
+def extract_parallel(body: IO, encoding: Optional[str], workers: int,
+                     fragment_size: int) -> Iterator[Tuple[List[tuple], int, Optional[int]]]:
+    """
+    Разбираем фрагменты таблицы в пуле процессов и отдаём результаты в порядке следования фрагментов.
+    В работе одновременно не больше 2 * workers фрагментов, чтобы не читать всё тело в память
+    """
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for fragment in split_rows(body, fragment_size):
+            pending.append(executor.submit(extract_fragment, fragment, encoding))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
@@ -0,0 +1,389 @@
+import time, hashlib, logging, tempfile
+from datetime import datetime
+from fastapi import (HTTPException, status)
+from requests import RequestException
+from lxml import etree
+from .. import tables
+from .extractor import RowExtractor
+from .parallel import COLUMNS as PARALLEL_COLUMNS, extract_parallel
+from .fas_client import fas_client
+from .history import MonopolyHistory
+from .partitions import PartitionRows, PartitionedFetch, count_expected, registry_partitions, table_closed
+from .monopoly import (REFRESH_LAST_ROWS, REFRESH_LAST_SUCCESS, REFRESH_PHASE_SECONDS, REFRESH_ROWS,
+                       publish_lookup_file, refresh_read_path)
+from .reconciliation import MonopolyReconciler
+from .upload import MonopolyUpload, READ_ERRORS
+from ..settings import settings, LOGGER
+
+
+class MonopolyParser:
+    """ Класс парсинга данных с сайта ФАС - списка естественных монополий """
+
+    def __init__(self, session):
+        self.session = session
+        self.rows_seen = 0
+        # Компаний в текущем списке перед загрузкой частями - общий порог полноты реестра
+        self.expected_rows = 0
+        # Время этапов обновления: получение токена, запрос таблицы, разбор HTML, извлечение полей
+        self.timings = {'token': 0.0, 'post': 0.0, 'html': 0.0, 'extract': 0.0}
+
+    def _last_refresh(self):
+        """ Последнее успешное обновление списка с сайта ФАС """
+        return self.session.query(tables.MonopolyRefresh) \
+            .filter(tables.MonopolyRefresh.kind == 'refresh') \
+            .filter(tables.MonopolyRefresh.status == 'success') \
+            .order_by(tables.MonopolyRefresh.id.desc()) \
+            .first()
+
+    def _get_monopoly_data(self, previous=None):
+        """
+        Получаем данные с сайта ФАС. Возвращаем ответ, тело которого ещё не прочитано.
+        Если сайт прислал ETag/Last-Modified при предыдущем обновлении, запрос делается условным
+        """
+        conditions = {}
+        if previous is not None:
+            if previous.etag:
+                conditions['If-None-Match'] = previous.etag
+            if previous.lastModified:
+                conditions['If-Modified-Since'] = previous.lastModified
+        started = time.perf_counter()
+        token = fas_client.get_token()
+        self.timings['token'] += time.perf_counter() - started
+        started = time.perf_counter()
+        response = fas_client.fetch_registry(token, conditions)
+        self.timings['post'] += time.perf_counter() - started
+        return response
+
+    def _download(self, response):
+        """ Сохраняем тело ответа во временный файл (в памяти до fas_spool_size) и считаем его отпечаток """
+        body = tempfile.SpooledTemporaryFile(max_size=settings.fas_spool_size)
+        digest = hashlib.sha256()
+        try:
+            for chunk in response.iter_content(chunk_size=settings.fas_chunk_size):
+                digest.update(chunk)
+                body.write(chunk)
+        except RequestException as error:
+            # Соединение оборвалось или истёк таймаут чтения посреди таблицы
+            body.close()
+            LOGGER.info('Error get data from site: %s', error)
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail='Error get data from site',
+                headers={'WWW-Authenticate': 'Bearer'},
+            )
+        finally:
+            response.close()
+        body.seek(0)
+        return body, digest.hexdigest()
+
+    def _drain_rows(self, htmlparser):
+        """ Отдаём строки таблицы, которые парсер уже разобрал, и освобождаем память от обработанных """
+        for _, element in htmlparser.read_events():
+            parent = element.getparent()
+            if parent is None or parent.tag != 'tbody':
+                continue
+            self.rows_seen += 1
+            yield element
+            element.clear()
+            while element.getprevious() is not None:
+                del parent[0]
+
+    def _iter_table_rows(self, body, encoding: str = None):
+        """ Потоково разбираем сохранённый ответ ФАС и по одной отдаём строки //tbody/tr """
+        htmlparser = etree.HTMLPullParser(events=('end',), tag='tr', encoding=encoding)
+        self.rows_seen = 0
+        for chunk in iter(lambda: body.read(settings.fas_chunk_size), b''):
+            started = time.perf_counter()
+            htmlparser.feed(chunk)
+            self.timings['html'] += time.perf_counter() - started
+            yield from self._drain_rows(htmlparser)
+        started = time.perf_counter()
+        htmlparser.close()
+        self.timings['html'] += time.perf_counter() - started
+        yield from self._drain_rows(htmlparser)
+
+    def _parse_rows(self, all_data_list, check_time: datetime):
+        """ Извлекаем из строк таблицы данные компаний для записи в базу. Строки отдаются по одной """
+        exception = HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='Error parse data',
+            headers={'WWW-Authenticate': 'Bearer'},
+        )
+        extractor = RowExtractor()
+        # Отладочная запись каждой строки замедляет разбор, поэтому пишем только каждую log_row_sample-ю
+        sample = settings.log_row_sample if LOGGER.isEnabledFor(logging.DEBUG) else 0
+
+        for number, item in enumerate(all_data_list):
+            started = time.perf_counter()
+            try:
+                full_fas_dict = extractor.extract(item)
+            except ValueError:
+                LOGGER.info('Error parse items - number %s', str(number))
+                raise exception
+            finally:
+                self.timings['extract'] += time.perf_counter() - started
+
+            if full_fas_dict is None:
+                continue
+
+            full_fas_dict['lastCheck'] = check_time
+            if sample and number % sample == 0:
+                LOGGER.debug('Parse company: %s ', full_fas_dict)
+            yield full_fas_dict
+
+    def _parse_rows_parallel(self, body, encoding: str, check_time: datetime):
+        """
+        Разбираем таблицу в parser_workers процессах: тело делится на фрагменты из целых строк <tr>,
+        результаты фрагментов отдаются в исходном порядке
+        """
+        self.rows_seen = 0
+        started = time.perf_counter()
+        # Во фрагментах нет <meta charset>, поэтому кодировку страницы передаём явно
+        for companies, seen, error in extract_parallel(body, encoding or 'utf-8', settings.parser_workers,
+                                                       settings.parser_fragment_size):
+            self.timings['extract'] += time.perf_counter() - started
+            if error is not None:
+                LOGGER.info('Error parse items - number %s', str(self.rows_seen + error))
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail='Error parse data',
+                    headers={'WWW-Authenticate': 'Bearer'},
+                )
+            self.rows_seen += seen
+            for values in companies:
+                company = dict(zip(PARALLEL_COLUMNS, values))
+                company['lastCheck'] = check_time
+                yield company
+            started = time.perf_counter()
+
+    def _registry_partitions(self):
+        """
+        Части реестра для загрузки по регионам (и типам реестра) и токен, с которым они запрашиваются.
+        None - в форме ФАС нет списков регионов, реестр загружается одним запросом
+        """
+        started = time.perf_counter()
+        token, options = fas_client.get_form()
+        self.timings['token'] += time.perf_counter() - started
+        partitions = registry_partitions(options, settings.fas_partition_by_type)
+        if not partitions:
+            LOGGER.info('Registry form has no region options, fetch registry with single request')
+            return None, None
+        self.expected_rows = count_expected(self.session, partitions)
+        return partitions, token
+
+    def _load_partition(self, filters: dict, token: str) -> PartitionRows:
+        """ Загружаем и разбираем одну часть реестра. Выполняется в потоке PartitionedFetch со своим парсером """
+        parser = MonopolyParser(None)
+        started = time.perf_counter()
+        response = fas_client.fetch_registry(token, **filters)
+        parser.timings['post'] += time.perf_counter() - started
+        encoding = response.encoding
+        started = time.perf_counter()
+        body, digest = parser._download(response)
+        parser.timings['download'] = time.perf_counter() - started
+        try:
+            # Оборванную таблицу не разбираем: последняя строка может быть неполной
+            closed = table_closed(body)
+            companies = list(parser._parse_rows(parser._iter_table_rows(body, encoding), None)) if closed else []
+        finally:
+            body.close()
+        return PartitionRows(companies, parser.rows_seen, digest, closed, parser.timings)
+
+    def _parse_partitioned(self, partitions: list, token: str, check_time: datetime, digests: dict):
+        """
+        Загружаем части реестра параллельно и отдаём компании каждой части на сверку сразу после того,
+        как она загружена и прошла проверку полноты. digests заполняется отпечатками частей
+        """
+        self.rows_seen = 0
+        fetch = PartitionedFetch(self._load_partition, token, workers=settings.fas_partition_workers,
+                                 retries=settings.fas_partition_retries, min_share=settings.fas_partition_min_share)
+        for partition, rows in fetch.results(partitions):
+            self.rows_seen += rows.seen
+            digests[repr(partition)] = rows.digest
+            for phase, value in rows.timings.items():
+                self.timings[phase] = self.timings.get(phase, 0.0) + value
+            for company in rows.companies:
+                company['lastCheck'] = check_time
+                yield company
+
+    def _observe(self, stats: dict, timings: dict):
+        """ Публикуем время этапов и количество строк успешного обновления в метриках """
+        for phase, value in timings.items():
+            REFRESH_PHASE_SECONDS.observe(value, phase=phase)
+        rows = {'seen': self.rows_seen, **{key: stats[key] for key in ('inserted', 'updated', 'touched', 'removed')}}
+        for kind, value in rows.items():
+            REFRESH_ROWS.inc(value, kind=kind)
+            REFRESH_LAST_ROWS.set(value, kind=kind)
+        REFRESH_LAST_SUCCESS.set(time.time())
+
+    def parser_monopoly(self, refresh: tables.MonopolyRefresh = None):
+        """
+        Основной метод парсинга данных с сайта ФАС - списка естественных монополий.
+        refresh - задание из очереди, в котором фиксируется результат (по умолчанию создаётся новая запись)
+        """
+
+        # Фиксируем начало процесса
+        start_time = datetime.now()
+        timings = self.timings
+
+        exception = HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='Error parse data',
+            headers={'WWW-Authenticate': 'Bearer'},
+        )
+
+        previous = self._last_refresh()
+        partitions, token = self._registry_partitions() if settings.fas_partitioned else (None, None)
+        digests = {}
+
+        body = None
+        if partitions:
+            # Части реестра загружаются параллельно по ходу сверки, поэтому условного запроса нет
+            # и разбор выполняется всегда; отпечаток списка считается по отпечаткам частей
+            unchanged = False
+            etag = last_modified = body_hash = None
+        else:
+            # Получаем данные с сайта ФАС, условным запросом относительно предыдущего обновления
+            response = self._get_monopoly_data(previous)
+            encoding = response.encoding
+            etag = response.headers.get('ETag')
+            last_modified = response.headers.get('Last-Modified')
+
+            if response.status_code == 304 and previous is not None:
+                # Сайт подтвердил, что список не менялся
+                response.close()
+                unchanged = True
+                body_hash = previous.bodyHash
+                etag = etag or previous.etag
+                last_modified = last_modified or previous.lastModified
+            else:
+                started = time.perf_counter()
+                body, body_hash = self._download(response)
+                timings['download'] = time.perf_counter() - started
+                unchanged = previous is not None and previous.bodyHash == body_hash
+
+        check_time = datetime.now()
+        reconciler = MonopolyReconciler(
+            self.session,
+            chunk_size=settings.reconcile_chunk_size,
+            previous_start=previous.startedAt if previous is not None else None,
+            history=MonopolyHistory(self.session, chunk_size=settings.reconcile_chunk_size),
+        )
+        try:
+            if unchanged:
+                # Список не изменился - одним запросом подтверждаем компании из предыдущего списка
+                reconciler.touch_unchanged(check_time)
+                self.rows_seen = previous.rows or 0
+            else:
+                # Строки таблицы разбираются по мере чтения и сразу передаются на запись в базу,
+                # в базу пишутся только новые и изменившиеся компании
+                if partitions:
+                    rows = self._parse_partitioned(partitions, token, check_time, digests)
+                elif settings.parser_workers > 1:
+                    rows = self._parse_rows_parallel(body, encoding, check_time)
+                else:
+                    rows = self._parse_rows(self._iter_table_rows(body, encoding), check_time)
+                reconciler.load_existing()
+                started = time.perf_counter()
+                reconciler.apply(rows, check_time)
+                timings['stream'] = time.perf_counter() - started
+
+                # Проверяем, что получили данные (в списке должно быть более 1000 записей)
+                if self.rows_seen < 1000:
+                    LOGGER.info('Resive data not containt >1000 items')
+                    raise exception
+                # При загрузке частями, кроме полноты каждой части, проверяем общее количество строк:
+                # части, подписи которых не совпали с регионами в базе, ничего не ожидают
+                if partitions and self.rows_seen < self.expected_rows * settings.fas_partition_min_share:
+                    LOGGER.info('Registry partitions contain %s rows, %s expected', self.rows_seen, self.expected_rows)
+                    raise exception
+
+                reconciler.touch_unchanged(check_time)
+                reconciler.sweep(start_time, datetime.now())
+                if partitions:
+                    body_hash = hashlib.sha256(
+                        '|'.join(digests[repr(partition)] for partition in partitions).encode('ascii')
+                    ).hexdigest()
+
+            # Изменения фиксируются одной транзакцией вместе с отметкой об успешном обновлении
+            if refresh is None:
+                refresh = tables.MonopolyRefresh(kind='refresh', createdAt=start_time)
+            refresh.status = 'success'
+            refresh.startedAt = start_time
+            refresh.finishedAt = datetime.now()
+            refresh.etag = etag
+            refresh.lastModified = last_modified
+            refresh.bodyHash = body_hash
+            refresh.rows = self.rows_seen
+            for key in ('inserted', 'updated', 'touched', 'removed'):
+                setattr(refresh, key, reconciler.stats[key])
+            self.session.add(refresh)
+            started = time.perf_counter()
+            self.session.commit()
+            timings['commit'] = time.perf_counter() - started
+        except Exception:
+            self.session.rollback()
+            raise
+        finally:
+            if body is not None:
+                body.close()
+
+        # Сбрасываем закэшированные результаты проверок после фиксации новых данных
+        # и записываем файл поиска по ИНН для остальных процессов
+        refresh_read_path(self.session)
+        started = time.perf_counter()
+        publish_lookup_file(self.session)
+        timings['lookup_file'] = time.perf_counter() - started
+
+        timings.update(reconciler.timings)
+        timings['write'] = sum(timings[key] for key in ('insert', 'update', 'touch', 'remove', 'commit'))
+        timings['total'] = (datetime.now() - start_time).total_seconds()
+        self._observe(reconciler.stats, timings)
+        LOGGER.info('Monopoly list reconciled (unchanged: %s): %s, timings: %s', unchanged, reconciler.stats, timings)
+
+        return {
+            'detail': 'Update monopoly list successfully',
+            'seen': self.rows_seen,
+            'unchanged': unchanged,
+            'partitions': len(partitions) if partitions else 0,
+            'retries': sum(partition.attempts - 1 for partition in partitions or ()),
+            **reconciler.stats,
+            'timings': {phase: round(value, 4) for phase, value in timings.items()},
+        }
+
+    def monopoly_upload(self, file, filename: str = ''):
+        """
+        Метод ручной загрузки списка естественных монополий из файла Excel или CSV.
+        Файл читается построчно, данные записываются пачками одной транзакцией
+        """
+        start_time = datetime.now()
+        upload = MonopolyUpload(self.session, batch_size=settings.upload_batch_size,
+                                history=MonopolyHistory(self.session, chunk_size=settings.upload_batch_size))
+        try:
+            upload.apply(upload.records(upload.read(file, filename)))
+            self.session.add(tables.MonopolyRefresh(
+                kind='upload',
+                status='success',
+                createdAt=start_time,
+                startedAt=start_time,
+                finishedAt=datetime.now(),
+                rows=upload.stats['rows'],
+            ))
+            self.session.commit()
+        except READ_ERRORS as error:
+            self.session.rollback()
+            LOGGER.info('Error read upload file: %s', error)
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail='Error parse data',
+                headers={'WWW-Authenticate': 'Bearer'},
+            )
+        except Exception:
+            self.session.rollback()
+            raise
+
+        LOGGER.info('Manual upload: %s rows in %.3f s', upload.stats, (datetime.now() - start_time).total_seconds())
+        refresh_read_path(self.session)
+        publish_lookup_file(self.session)
+
+        return HTTPException(status_code=200, detail="Upload success")
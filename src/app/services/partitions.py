@@ -0,0 +1,162 @@
+import threading, time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Iterator, List, Tuple
+from fastapi import (HTTPException, status)
+from sqlalchemy import func
+from .. import tables
+from .fas_client import fas_client
+from ..settings import settings, LOGGER
+
+# Поля формы поиска ФАС, по которым делится реестр, и колонки таблицы monopoly с теми же значениями
+REGION_FIELD = ('RegionID', 'region')
+TYPE_FIELD = ('RegTypeID', 'registry')
+
+# Сколько последних байт ответа просматривается в поисках закрывающего тега таблицы
+TAIL_SIZE = 4096
+
+
+class IncompletePartition(Exception):
+    """ Часть реестра получена не полностью: таблица оборвана или в ней слишком мало строк """
+
+
+class Partition:
+    """ Часть реестра: значения фильтров формы ФАС и соответствующие им значения колонок region, registry """
+
+    def __init__(self, filters: dict, labels: dict):
+        self.filters = filters
+        self.labels = labels
+        # Сколько компаний этой части в текущем списке (без загруженных вручную)
+        self.expected = 0
+        self.attempts = 0
+
+    def __repr__(self):
+        return ', '.join(f'{field}={value}' for field, value in self.filters.items())
+
+
+class PartitionRows:
+    """ Загруженная часть реестра: компании, количество строк таблицы, отпечаток тела ответа и время этапов """
+
+    def __init__(self, companies: List[dict], seen: int, digest: str, closed: bool, timings: dict):
+        self.companies = companies
+        self.seen = seen
+        self.digest = digest
+        self.closed = closed
+        self.timings = timings
+
+
+def table_closed(body) -> bool:
+    """ Ответ дочитан до закрывающего тега таблицы. Позиция файла возвращается в начало """
+    body.seek(0, 2)
+    body.seek(max(0, body.tell() - TAIL_SIZE))
+    tail = body.read().lower()
+    body.seek(0)
+    return b'</table>' in tail
+
+
+def registry_partitions(options: dict, by_type: bool = False) -> List[Partition]:
+    """
+    Делим реестр по значениям списков формы ФАС: по регионам, с by_type - по регионам и типам реестра.
+    Пустой список - в форме нет нужных списков, реестр загружается одним запросом
+    """
+    partitions = [Partition({}, {})]
+    for field, column in [REGION_FIELD] + ([TYPE_FIELD] if by_type else []):
+        values = options.get(field)
+        if not values:
+            return []
+        partitions = [
+            Partition({**partition.filters, field: value}, {**partition.labels, column: label})
+            for partition in partitions for value, label in values.items()
+        ]
+    return partitions
+
+
+def count_expected(session, partitions: List[Partition]) -> int:
+    """
+    Количество компаний каждой части в текущем списке одним запросом GROUP BY.
+    Возвращаем количество компаний во всём текущем списке (без загруженных вручную)
+    """
+    if not partitions:
+        return 0
+    table = tables.Monopoly.__table__
+    columns = [table.c[column] for column in partitions[0].labels]
+    query = session.query(*columns, func.count()) \
+        .filter(table.c.removeDate == None) \
+        .filter(table.c.manualUpload.isnot(True)) \
+        .group_by(*columns)
+    counts = {tuple(row[:-1]): row[-1] for row in query}
+    for partition in partitions:
+        partition.expected = counts.get(tuple(partition.labels.values()), 0)
+    labels = {tuple(partition.labels.values()) for partition in partitions}
+    unmatched = {key: count for key, count in counts.items() if key not in labels}
+    if unmatched:
+        # Подписи частей в форме ФАС не совпали с регионами в базе: для таких компаний проверка полноты
+        # частей ничего не ожидает, их защищает только общий порог количества строк
+        LOGGER.info('No registry partition for %s companies of current list: %s', sum(unmatched.values()),
+                    '; '.join('/'.join(map(str, key)) for key in list(unmatched)[:10]))
+    return sum(counts.values())
+
+
+class PartitionedFetch:
+    """
+    Загрузка реестра частями не более чем в workers потоках с одним токеном и общим пулом соединений.
+    load(filters, token) загружает и разбирает одну часть; неполученная или неполная часть запрашивается
+    повторно (до retries раз) независимо от остальных
+    """
+
+    def __init__(self, load: Callable[[dict, str], PartitionRows], token: str, workers: int = 4,
+                 retries: int = 2, min_share: float = 0.5):
+        self.load = load
+        self.token = token
+        self.workers = max(1, workers)
+        self.retries = retries
+        self.min_share = min_share
+        self.lock = threading.Lock()
+
+    def _refresh_token(self, used: str):
+        """ Получаем новый токен один раз на все потоки: другой поток мог уже заменить его """
+        with self.lock:
+            if self.token == used:
+                self.token = fas_client.get_token()
+
+    def check(self, partition: Partition, rows: PartitionRows):
+        """ Проверка полноты части вместо общего порога на количество строк в реестре """
+        if not rows.closed:
+            raise IncompletePartition('table is truncated')
+        if rows.seen < partition.expected * self.min_share:
+            raise IncompletePartition(f'{rows.seen} rows, {partition.expected} expected')
+
+    def fetch(self, partition: Partition) -> PartitionRows:
+        """ Загружаем часть с повторами. Выполняется в потоке пула """
+        while True:
+            token = self.token
+            partition.attempts += 1
+            try:
+                rows = self.load(partition.filters, token)
+                self.check(partition, rows)
+                return rows
+            except (HTTPException, IncompletePartition) as error:
+                reason = error.detail if isinstance(error, HTTPException) else error
+                if partition.attempts > self.retries:
+                    LOGGER.info('Error get registry partition %s: %s', partition, reason)
+                    if isinstance(error, HTTPException):
+                        raise
+                    raise HTTPException(
+                        status_code=status.HTTP_400_BAD_REQUEST,
+                        detail='Error get data from site',
+                        headers={'WWW-Authenticate': 'Bearer'},
+                    )
+                LOGGER.info('Retry registry partition %s (attempt %s): %s', partition, partition.attempts, reason)
+                time.sleep(settings.fas_backoff * partition.attempts)
+                if isinstance(error, HTTPException):
+                    # Сайт мог отклонить запрос из-за истёкшего токена
+                    self._refresh_token(token)
+
+    def results(self, partitions: List[Partition]) -> Iterator[Tuple[Partition, PartitionRows]]:
+        """ Отдаём части по мере загрузки. Если часть не получена, оставшиеся запросы отменяются """
+        executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='fas-partition')
+        try:
+            futures = {executor.submit(self.fetch, partition): partition for partition in partitions}
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
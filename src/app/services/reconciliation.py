@@ -0,0 +1,216 @@
+import time
+from datetime import datetime
+from typing import Iterable, List, Optional
+from sqlalchemy import Column, MetaData, String, Table, bindparam, select
+from sqlalchemy.dialects import postgresql, sqlite
+from .. import tables
+
+# Поля реестра, по которым определяется, изменились ли данные компании
+FIELDS = ('companyName', 'registry', 'section', 'docNumber', 'region', 'address', 'dateFirstReg')
+
+# Временная таблица ИНН, пропавших из списка, - если их больше chunk_size, они не передаются параметрами запроса
+DISAPPEARED = Table('tmp_monopoly_disappeared', MetaData(), Column('inn', String(12), primary_key=True),
+                    prefixes=['TEMPORARY'])
+
+
+def upsert_statement(session, update_columns: Iterable[str]):
+    """
+    INSERT ... ON CONFLICT по уникальному ИНН, обновляющий при конфликте колонки update_columns.
+    Для СУБД без ON CONFLICT возвращается обычный INSERT
+    """
+    table = tables.Monopoly.__table__
+    dialect = session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        stmt = postgresql.insert(table)
+        return stmt.on_conflict_do_update(
+            constraint='uq__monopoly__inn',
+            set_={column: stmt.excluded[column] for column in update_columns},
+        )
+    if dialect == 'sqlite':
+        stmt = sqlite.insert(table)
+        return stmt.on_conflict_do_update(
+            index_elements=[table.c.inn],
+            set_={column: stmt.excluded[column] for column in update_columns},
+        )
+    return table.insert()
+
+
+def sweep_statement(start_time: datetime, remove_time: datetime):
+    """
+    UPDATE исключённых из списка компаний: не подтверждённые с start_time, ещё не исключённые и загруженные
+    не вручную. Условие совпадает с условием частичного индекса ix__monopoly__lastCheck_sweep.
+    manualUpload IS NOT TRUE - чтобы попадали и записи с manualUpload = NULL (все записи с сайта ФАС)
+    """
+    table = tables.Monopoly.__table__
+    return table.update() \
+        .where(table.c.lastCheck < start_time) \
+        .where(table.c.removeDate.is_(None)) \
+        .where(table.c.manualUpload.isnot(True)) \
+        .values(removeDate=remove_time)
+
+
+class MonopolyReconciler:
+    """
+    Класс пакетной сверки списка естественных монополий с данными в нашей базе.
+
+    Если известно время начала предыдущего успешного обновления (previous_start), в базу пишутся только
+    новые и изменившиеся компании, а дата проверки остальных обновляется одним запросом.
+    Если передан history, для новых, изменившихся, вернувшихся в список и исключённых компаний пишутся версии.
+    Данные компаний, загруженных вручную (manualUpload), сверка не перезаписывает - обновляется только дата проверки.
+    """
+
+    def __init__(self, session, chunk_size: int = 1000, previous_start: Optional[datetime] = None, history=None):
+        self.session = session
+        self.chunk_size = chunk_size
+        self.previous_start = previous_start
+        self.history = history
+        self.existing = {}
+        self.seen = set()
+        self.stats = {'rows': 0, 'inserted': 0, 'updated': 0, 'touched': 0, 'removed': 0}
+        self.timings = {'load': 0.0, 'insert': 0.0, 'update': 0.0, 'touch': 0.0, 'remove': 0.0, 'history': 0.0}
+
+    def load_existing(self):
+        """
+        Одним запросом загружаем ИНН, данные, дату последней проверки, признак исключения из списка
+        и признак ручной загрузки компаний, которые уже есть в базе
+        """
+        started = time.perf_counter()
+        table = tables.Monopoly.__table__
+        columns = [table.c.inn, table.c.lastCheck, table.c.removeDate, table.c.manualUpload] + \
+            [table.c[field] for field in FIELDS]
+        self.existing = {
+            row[0]: (tuple(row[4:]), row[1], row[2] is not None, bool(row[3]))
+            for row in self.session.execute(table.select().with_only_columns(columns))
+        }
+        self.timings['load'] += time.perf_counter() - started
+        return self.existing
+
+    def _insert(self, rows: List[dict]):
+        """ Добавляем новые записи одним многострочным INSERT """
+        if not rows:
+            return
+        started = time.perf_counter()
+        self.session.execute(upsert_statement(self.session, ['lastCheck']), rows)
+        self.stats['inserted'] += len(rows)
+        self.timings['insert'] += time.perf_counter() - started
+
+    def _update(self, rows: List[dict]):
+        """ Перезаписываем данные изменившихся и вернувшихся в список компаний одним пакетным UPDATE """
+        if not rows:
+            return
+        started = time.perf_counter()
+        table = tables.Monopoly.__table__
+        stmt = table.update() \
+            .where(table.c.inn == bindparam('b_inn')) \
+            .values({**{field: bindparam('b_' + field) for field in FIELDS + ('lastCheck',)}, 'removeDate': None})
+        self.session.execute(stmt, [
+            {'b_' + field: row[field] for field in ('inn', 'lastCheck') + FIELDS} for row in rows
+        ])
+        self.stats['updated'] += len(rows)
+        self.timings['update'] += time.perf_counter() - started
+
+    def _touch(self, inns: List[str], check_time: datetime):
+        """ Обновляем дату последней проверки для уже известных ИНН одним UPDATE на пачку """
+        if not inns:
+            return
+        started = time.perf_counter()
+        self.session.query(tables.Monopoly) \
+            .filter(tables.Monopoly.inn.in_(inns)) \
+            .update({tables.Monopoly.lastCheck: check_time}, synchronize_session=False)
+        self.stats['touched'] += len(inns)
+        self.timings['touch'] += time.perf_counter() - started
+
+    def _confirmed_by_previous(self, last_check: Optional[datetime]) -> bool:
+        """ Компания была в списке при предыдущем успешном обновлении """
+        return self.previous_start is not None and last_check is not None and last_check >= self.previous_start
+
+    def _flush_chunk(self, chunk: List[dict], check_time: datetime):
+        """ Разделяем пачку на новые, изменившиеся и неизменные компании и записываем отличия в базу """
+        new_rows, changed_rows, touch_inns = [], [], []
+        for row in chunk:
+            known = self.existing.get(row['inn'])
+            if known is None:
+                new_rows.append(row)
+            elif known[3]:
+                # Исправления ручной загрузки не перезаписываем данными сайта ФАС
+                if not self._confirmed_by_previous(known[1]):
+                    touch_inns.append(row['inn'])
+            elif known[2] or known[0] != tuple(row[field] for field in FIELDS):
+                # Изменились данные или компания вернулась в список после исключения
+                changed_rows.append(row)
+            elif not self._confirmed_by_previous(known[1]):
+                # Неизменные компании из предыдущего списка обновит touch_unchanged одним запросом
+                touch_inns.append(row['inn'])
+        self._insert(new_rows)
+        self._update(changed_rows)
+        self._touch(touch_inns, check_time)
+        if self.history is not None:
+            started = time.perf_counter()
+            self.history.open(new_rows, check_time)
+            self.history.replace(changed_rows, check_time)
+            self.timings['history'] += time.perf_counter() - started
+        for row in new_rows + changed_rows:
+            self.existing[row['inn']] = (tuple(row[field] for field in FIELDS), check_time, False, False)
+
+    def apply(self, rows: Iterable[dict], check_time: datetime):
+        """ Записываем в базу строки реестра пачками по chunk_size """
+        chunk = []
+        for row in rows:
+            # Повторное вхождение ИНН в реестр не меняет результат сверки
+            if row['inn'] in self.seen:
+                continue
+            self.seen.add(row['inn'])
+            self.stats['rows'] += 1
+            chunk.append(row)
+            if len(chunk) >= self.chunk_size:
+                self._flush_chunk(chunk, check_time)
+                chunk = []
+        self._flush_chunk(chunk, check_time)
+        return self.stats
+
+    def touch_unchanged(self, check_time: datetime):
+        """
+        Одним запросом обновляем дату проверки компаний, которые были в предыдущем списке и не изменились.
+        Пропавшие из списка компании исключаются, чтобы их нашёл sweep; больше chunk_size - через временную таблицу
+        """
+        if self.previous_start is None:
+            return 0
+        started = time.perf_counter()
+        disappeared = [
+            inn for inn, (_, last_check, _, _) in self.existing.items()
+            if inn not in self.seen and self._confirmed_by_previous(last_check)
+        ]
+        query = self.session.query(tables.Monopoly) \
+            .filter(tables.Monopoly.lastCheck >= self.previous_start) \
+            .filter(tables.Monopoly.lastCheck < check_time)
+        staged = len(disappeared) > self.chunk_size
+        if staged:
+            # Большой список исключаем через временную таблицу: NOT IN (...) с параметрами упирается
+            # в ограничение SQLite на их количество и раздувает запрос в PostgreSQL
+            connection = self.session.connection()
+            DISAPPEARED.create(connection)
+            for position in range(0, len(disappeared), self.chunk_size):
+                connection.execute(DISAPPEARED.insert(), [
+                    {'inn': inn} for inn in disappeared[position:position + self.chunk_size]
+                ])
+            query = query.filter(tables.Monopoly.inn.notin_(select(DISAPPEARED.c.inn)))
+        elif disappeared:
+            query = query.filter(tables.Monopoly.inn.notin_(disappeared))
+        touched = query.update({tables.Monopoly.lastCheck: check_time}, synchronize_session=False)
+        if staged:
+            DISAPPEARED.drop(connection)
+        self.stats['touched'] += touched
+        self.timings['touch'] += time.perf_counter() - started
+        return touched
+
+    def sweep(self, start_time: datetime, remove_time: datetime):
+        """ Для всех записей, которые "пропали" при очередной проверке - фиксируем дату удаления """
+        started = time.perf_counter()
+        removed = self.session.execute(sweep_statement(start_time, remove_time)).rowcount
+        self.stats['removed'] += removed
+        self.timings['remove'] += time.perf_counter() - started
+        if self.history is not None and removed:
+            started = time.perf_counter()
+            self.history.close_removed(remove_time)
+            self.timings['history'] += time.perf_counter() - started
+        return removed
@@ -0,0 +1,339 @@
+import re, heapq, math, threading, time
+from array import array
+from collections import Counter
+from itertools import groupby
+from typing import Dict, Iterable, List, Optional, Tuple
+from fastapi import (HTTPException, status)
+from sqlalchemy import String, func, literal, literal_column, select
+from .. import tables
+from ..database import Session
+from ..settings import settings, LOGGER
+from .snapshot import COLUMNS, registry_snapshot
+
+# Организационно-правовые формы, которые не учитываются при поиске
+LEGAL_FORMS = frozenset((
+    'ооо', 'оао', 'зао', 'пао', 'нао', 'ао', 'ип', 'муп', 'гуп', 'фгуп', 'гбу', 'мбу', 'мку', 'ано', 'нко', 'тсж',
+))
+LEGAL_FORM_PHRASES = re.compile(
+    r'общество с ограниченной ответственностью'
+    r'|(?:публичное |непубличное |открытое |закрытое )?акционерное общество'
+    r'|(?:федеральное |муниципальное )?(?:государственное )?унитарное предприятие'
+    r'|индивидуальный предприниматель'
+)
+# Кавычки, знаки препинания и прочие разделители слов
+SEPARATORS = re.compile(r'[\W_]+')
+
+# Поля, по которым выполняется поиск
+FIELDS = ('companyName', 'address', 'region')
+ID = COLUMNS.index('id')
+REMOVE_DATE = COLUMNS.index('removeDate')
+FIELD_POSITIONS = tuple(COLUMNS.index(field) for field in FIELDS)
+# Примерное количество слов в записи: если похожих слов много, кандидатов проверяем по словам самих записей,
+# пока это дешевле пересечения со всеми списками записей похожих слов
+AVERAGE_WORDS = 16
+
+
+def search_document():
+    """
+    Поля записи одной строкой в нижнем регистре и с «е» вместо «ё», как слова запроса после normalize, -
+    то же выражение, по которому миграция e4b8d1f6a273 строит GIN индекс ix__monopoly__search_trgm
+    (константы без параметров, чтобы выражение запроса совпадало с индексом).
+    Кавычки и знаки препинания pg_trgm сам считает разделителями слов, а организационно-правовые формы
+    в записи не мешают: word_similarity оценивает, насколько слова запроса встречаются в записи
+    """
+    separator = literal_column("' '", String)
+    fields = [func.coalesce(getattr(tables.Monopoly, field), literal_column("''", String)) for field in FIELDS]
+    document = fields[0] + separator + fields[1] + separator + fields[2]
+    return func.translate(func.lower(document), literal_column("'ё'", String), literal_column("'е'", String))
+
+
+def normalize(text: Optional[str]) -> List[str]:
+    """ Слова строки в нижнем регистре, без кавычек, знаков препинания и организационно-правовых форм """
+    if not text:
+        return []
+    text = LEGAL_FORM_PHRASES.sub(' ', text.lower().replace('ё', 'е'))
+    return [word for word in SEPARATORS.sub(' ', text).split() if word not in LEGAL_FORMS]
+
+
+def trigrams(word: str) -> set:
+    """ Триграммы слова так же, как в pg_trgm: с двумя пробелами в начале и одним в конце """
+    padded = f'  {word} '
+    return {padded[position:position + 3] for position in range(len(padded) - 2)}
+
+
+class TrigramIndex:
+    """
+    Поисковый индекс в памяти процесса для SQLite и режима снимка (snapshot_enabled).
+    Два уровня: триграммы -> слова словаря (нечёткое совпадение слова) и слово -> записи, в которых оно встречается.
+    Словарь намного меньше таблицы, поэтому нечёткий поиск слова дешёвый, а списки записей читаются только по
+    совпавшим словам
+    """
+
+    def __init__(self, records: Iterable[tuple], rows: Optional[list] = None):
+        """ records - кортежи (id, removed, companyName, address, region); rows - строки снимка в том же порядке """
+        self.rows = rows
+        self.ids = array('q')
+        self.removed = bytearray()
+        self.words: Dict[str, int] = {}
+        self.vocabulary: List[str] = []
+        self.postings: List[array] = []
+        self.trigrams: Dict[str, array] = {}
+        # Слова каждой записи подряд в одном массиве: слова записи i - record_words[offsets[i]:offsets[i + 1]]
+        self.record_words = array('I')
+        self.offsets = array('Q', [0])
+        for position, (row_id, removed, *values) in enumerate(records):
+            self.ids.append(row_id)
+            self.removed.append(bool(removed))
+            for word in {word for value in values for word in normalize(value)}:
+                word_id = self.words.get(word)
+                if word_id is None:
+                    word_id = self.words[word] = len(self.postings)
+                    self.vocabulary.append(word)
+                    self.postings.append(array('I'))
+                    for trigram in trigrams(word):
+                        self.trigrams.setdefault(trigram, array('I')).append(word_id)
+                # Записи добавляются по порядку, поэтому списки отсортированы
+                self.postings[word_id].append(position)
+                self.record_words.append(word_id)
+            self.offsets.append(len(self.record_words))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _similar_words(self, word: str, threshold: float) -> List[Tuple[int, float]]:
+        """
+        Слова словаря, в которых встречается доля threshold триграмм слова запроса (как word_similarity в pg_trgm:
+        префикс "ромаш" находит "ромашка"). Более похожие слова первыми.
+        Слово с нужной долей триграмм обязательно есть в одном из len - need + 1 самых коротких списков,
+        поэтому считаем совпадения только по ним, а остальные триграммы проверяем у найденных слов
+        """
+        query = sorted(trigrams(word), key=lambda trigram: len(self.trigrams.get(trigram, ())))
+        need = math.ceil(threshold * len(query) - 1e-9)
+        rare, common = query[:len(query) - need + 1], query[len(query) - need + 1:]
+        counts = Counter()
+        for trigram in rare:
+            counts.update(self.trigrams.get(trigram, ()))
+        similar = []
+        for word_id, count in counts.items():
+            if common:
+                padded = f'  {self.vocabulary[word_id]} '
+                count += sum(trigram in padded for trigram in common)
+            if count >= need:
+                similar.append((word_id, count / len(query)))
+        similar.sort(key=lambda item: -item[1])
+        return similar
+
+    def _match(self, similar: List[Tuple[int, float]]) -> Dict[int, float]:
+        """ Записи, содержащие похожие слова, с лучшей оценкой совпадения """
+        found = {}
+        for word_id, score in similar:
+            for position in self.postings[word_id]:
+                if position not in found:
+                    found[position] = score
+        return found
+
+    def _intersect(self, candidates: Dict[int, float], similar: List[Tuple[int, float]]) -> Dict[int, float]:
+        """ Оставляем кандидатов, содержащих одно из похожих слов: пересечение множеств выполняется без цикла Python """
+        found = {}
+        for word_id, score in similar:
+            for position in candidates.keys() & self.postings[word_id]:
+                if position not in found:
+                    found[position] = candidates[position] + score
+        return found
+
+    def _filter_words(self, candidates: Dict[int, float], similar: List[Tuple[int, float]]):
+        """ Оставляем кандидатов, содержащих одно из похожих слов, по словам самих записей - когда похожих слов много """
+        scores = dict(similar)
+        record_words, offsets = self.record_words, self.offsets
+        for position in list(candidates):
+            common = scores.keys() & record_words[offsets[position]:offsets[position + 1]]
+            if common:
+                candidates[position] += max(scores[word_id] for word_id in common)
+            else:
+                del candidates[position]
+
+    def _top(self, similar: List[Tuple[int, float]], history: bool, limit: int) -> List[Tuple[int, float]]:
+        """
+        Первые limit записей для запроса из одного слова без сбора всех совпадений: слова с одинаковой оценкой
+        обходим слиянием отсортированных списков записей и останавливаемся, набрав limit записей
+        """
+        found, seen = [], set()
+        for score, group in groupby(similar, key=lambda item: item[1]):
+            for position in heapq.merge(*(self.postings[word_id] for word_id, _ in group)):
+                if position in seen or (not history and self.removed[position]):
+                    continue
+                seen.add(position)
+                found.append((position, score))
+                if len(found) >= limit:
+                    return found
+        return found
+
+    def search(self, query: List[str], history: bool, threshold: float, limit: int) -> List[Tuple[int, float]]:
+        """
+        Позиции записей, содержащих все слова запроса (нечётко), по убыванию средней оценки совпадения слов.
+        Сначала берём самое редкое слово запроса, остальные только сужают набор кандидатов
+        """
+        words = []
+        for word in dict.fromkeys(query):
+            similar = self._similar_words(word, threshold)
+            if not similar:
+                return []
+            words.append((sum(len(self.postings[word_id]) for word_id, _ in similar), similar))
+        words.sort(key=lambda item: item[0])
+        if len(words) == 1:
+            return self._top(words[0][1], history, limit)
+
+        candidates = None
+        for total, similar in words:
+            if candidates is None:
+                candidates = self._match(similar)
+            elif len(similar) <= AVERAGE_WORDS or len(candidates) * AVERAGE_WORDS >= total:
+                candidates = self._intersect(candidates, similar)
+            else:
+                self._filter_words(candidates, similar)
+            if not candidates:
+                return []
+        if not history:
+            candidates = {position: score for position, score in candidates.items() if not self.removed[position]}
+        best = heapq.nsmallest(limit, candidates.items(), key=lambda item: (-item[1], item[0]))
+        return [(position, score / len(words)) for position, score in best]
+
+
+class SearchIndexHolder:
+    """
+    Хранит поисковый индекс процесса. Индекс строится при первом поиске, либо (search_preload) заранее вместе
+    с обновлением снимка. После обновления списка построенный индекс перестраивается в фоновом потоке,
+    а поиск до подмены идёт по старому
+    """
+
+    def __init__(self):
+        self.index: Optional[TrigramIndex] = None
+        self.lock = threading.Lock()
+        # Фоновое построение после обновления: поток и признак, что список обновился ещё раз во время построения
+        self.rebuild_lock = threading.Lock()
+        self.rebuild_thread: Optional[threading.Thread] = None
+        self.rebuild_pending = False
+
+    def reload(self, session) -> TrigramIndex:
+        """ Строим новый индекс и подменяем им текущий; поиск до подмены идёт по старому индексу """
+        index = self._build(session)
+        self.index = index
+        return index
+
+    def refresh(self):
+        """
+        После обновления списка перестраиваем индекс в фоновом потоке, чтобы поиск не ждал построения.
+        Индекс, который в процессе ещё не строился (поиска не было), построит первый поиск
+        """
+        if self.index is None:
+            return
+        with self.rebuild_lock:
+            self.rebuild_pending = True
+            if self.rebuild_thread is None:
+                self.rebuild_thread = threading.Thread(target=self._rebuild, name='search-index', daemon=True)
+                self.rebuild_thread.start()
+
+    def _rebuild(self):
+        while True:
+            with self.rebuild_lock:
+                if not self.rebuild_pending:
+                    self.rebuild_thread = None
+                    return
+                self.rebuild_pending = False
+            session = Session()
+            try:
+                self.reload(session)
+            except Exception:
+                LOGGER.exception('Error build search index')
+            finally:
+                session.close()
+
+    def get(self, session) -> TrigramIndex:
+        index = self.index
+        if index is not None:
+            return index
+        with self.lock:
+            if self.index is None:
+                self.index = self._build(session)
+            return self.index
+
+    @staticmethod
+    def _build(session) -> TrigramIndex:
+        """ Строим индекс из снимка в памяти, если он загружен, иначе - потоком строк из базы """
+        started = time.perf_counter()
+        snapshot = registry_snapshot.snapshot
+        if settings.snapshot_enabled and snapshot is not None:
+            records = ((row[ID], row[REMOVE_DATE] is not None, *(row[field] for field in FIELD_POSITIONS))
+                       for row in snapshot.rows)
+            index = TrigramIndex(records, rows=snapshot.rows)
+        else:
+            table = tables.Monopoly.__table__
+            query = select(table.c.id, table.c.removeDate != None, *(table.c[field] for field in FIELDS)) \
+                .order_by(table.c.id)
+            index = TrigramIndex(session.execute(query.execution_options(stream_results=True)))
+        LOGGER.info('Monopoly search index built: %s rows, %s words in %.3f s',
+                    len(index), len(index.words), time.perf_counter() - started)
+        return index
+
+
+search_index = SearchIndexHolder()
+
+
+class MonopolySearch:
+    """
+    Класс поиска компаний в списке монополий по наименованию, адресу и региону.
+    В PostgreSQL - триграммный поиск pg_trgm по GIN индексам, в SQLite и режиме снимка - по индексу в памяти
+    """
+
+    def __init__(self, session):
+        self.session = session
+
+    def _use_trgm(self) -> bool:
+        if settings.search_backend != 'auto':
+            return settings.search_backend == 'trgm'
+        # В режиме снимка поиск, как и проверки, не обращается к базе
+        return not settings.snapshot_enabled and self.session.bind.dialect.name == 'postgresql'
+
+    def _search_trgm(self, words: List[str], history: bool, limit: int, offset: int) -> List[Tuple[dict, float]]:
+        """ Оценка - word_similarity запроса и полей записи; оператор <% использует GIN индекс gin_trgm_ops """
+        monopoly = tables.Monopoly
+        query = literal(' '.join(words), String)
+        document = search_document()
+        score = func.word_similarity(query, document).label('score')
+        statement = select(monopoly, score) \
+            .where(query.op('<%')(document.self_group())) \
+            .order_by(score.desc(), monopoly.id) \
+            .limit(limit) \
+            .offset(offset)
+        if not history:
+            statement = statement.where(monopoly.removeDate == None)
+        self.session.execute(select(func.set_config(
+            'pg_trgm.word_similarity_threshold', str(settings.search_threshold), True)))
+        return [({column.name: getattr(company, column.name) for column in monopoly.__table__.columns}, score)
+                for company, score in self.session.execute(statement)]
+
+    def _search_index(self, words: List[str], history: bool, limit: int, offset: int) -> List[Tuple[dict, float]]:
+        index = search_index.get(self.session)
+        found = index.search(words, history, settings.search_threshold, offset + limit)[offset:]
+        if index.rows is not None:
+            return [(dict(zip(COLUMNS, index.rows[position])), score) for position, score in found]
+        ids = [index.ids[position] for position, _ in found]
+        companies = {company.id: company for company in self.session.execute(
+            select(tables.Monopoly).where(tables.Monopoly.id.in_(ids))).scalars()}
+        return [({column.name: getattr(companies[row_id], column.name) for column in tables.Monopoly.__table__.columns},
+                 score) for row_id, (_, score) in zip(ids, found) if row_id in companies]
+
+    def search(self, text: str, history: bool, page: int, size: int) -> dict:
+        words = normalize(text)
+        if not words:
+            raise HTTPException(status.HTTP_422_UNPROCESSABLE_ENTITY, detail='Empty search query')
+        search = self._search_trgm if self._use_trgm() else self._search_index
+        # Запрашиваем на одну запись больше, чтобы узнать, есть ли следующая страница
+        found = search(words, history, size + 1, (page - 1) * size)
+        return {
+            'query': ' '.join(words),
+            'page': page,
+            'size': size,
+            'more': len(found) > size,
+            'items': [{**company, 'score': round(float(score), 3)} for company, score in found[:size]],
+        }
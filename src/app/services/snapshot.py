@@ -0,0 +1,59 @@
+import time
+from datetime import datetime
+from typing import Optional
+from .. import tables
+from ..settings import LOGGER
+
+# Порядок полей в строке снимка совпадает с порядком колонок таблицы
+COLUMNS = tuple(column.name for column in tables.Monopoly.__table__.columns)
+INN = COLUMNS.index('inn')
+REMOVE_DATE = COLUMNS.index('removeDate')
+
+
+class MonopolySnapshot:
+    """ Неизменяемый снимок списка монополий в памяти процесса """
+
+    __slots__ = ('rows', 'index', 'current', 'loaded_at')
+
+    def __init__(self, rows: list):
+        # Строки хранятся кортежами в одном списке, индекс указывает позицию строки по ИНН
+        self.rows = rows
+        self.index = {row[INN]: position for position, row in enumerate(rows)}
+        self.current = frozenset(row[INN] for row in rows if row[REMOVE_DATE] is None)
+        self.loaded_at = datetime.now()
+
+    @classmethod
+    def load(cls, session) -> 'MonopolySnapshot':
+        """ Загружаем всю таблицу одним запросом """
+        result = session.execute(tables.Monopoly.__table__.select())
+        return cls([tuple(row) for row in result])
+
+    def get(self, inn: str, history: bool) -> Optional[dict]:
+        """ Проверяем наличие компании в снимке так же, как запрос company_query в базе """
+        if not history and inn not in self.current:
+            return None
+        position = self.index.get(inn)
+        if position is None:
+            return None
+        return dict(zip(COLUMNS, self.rows[position]))
+
+    def __len__(self):
+        return len(self.rows)
+
+
+class SnapshotHolder:
+    """ Хранит текущий снимок и атомарно подменяет его после обновления данных """
+
+    def __init__(self):
+        self.snapshot: Optional[MonopolySnapshot] = None
+
+    def reload(self, session) -> MonopolySnapshot:
+        """ Строим новый снимок и подменяем им текущий одной операцией присваивания """
+        started = time.perf_counter()
+        snapshot = MonopolySnapshot.load(session)
+        self.snapshot = snapshot
+        LOGGER.info('Monopoly snapshot loaded: %s rows in %.3f s', len(snapshot), time.perf_counter() - started)
+        return snapshot
+
+
+registry_snapshot = SnapshotHolder()
@@ -0,0 +1,149 @@
+import codecs, csv, zipfile
+from datetime import date, datetime
+from typing import IO, Iterable, Iterator
+from fastapi import (HTTPException, status)
+from openpyxl import load_workbook
+from openpyxl.utils.exceptions import InvalidFileException
+from sqlalchemy import select
+from .. import tables
+from .extractor import parse_date
+from .reconciliation import upsert_statement
+from ..settings import LOGGER
+
+# Список заголовков базы данных для проверки корректности наименований в файле
+DB_FIELDS = ('inn', 'companyName', 'registry', 'section', 'docNumber', 'region', 'address', 'dateFirstReg',
+             'manualUpload')
+
+# Ошибки чтения повреждённого или неверно выбранного файла
+READ_ERRORS = (zipfile.BadZipFile, InvalidFileException, UnicodeDecodeError, csv.Error)
+
+
+def _upload_exception() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail='Error parse data',
+        headers={'WWW-Authenticate': 'Bearer'},
+    )
+
+
+def read_xlsx(file: IO) -> Iterator[tuple]:
+    """ Построчно читаем первый лист книги Excel в режиме только для чтения, не загружая её целиком """
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        yield from workbook[workbook.sheetnames[0]].iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def read_csv(file: IO) -> Iterator[list]:
+    """ Построчно читаем CSV файл (UTF-8, разделитель , ; или табуляция) """
+    sample = file.read(65536).decode('utf-8-sig', errors='ignore')
+    file.seek(0)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+    yield from csv.reader(codecs.getreader('utf-8-sig')(file), dialect)
+
+
+class MonopolyUpload:
+    """ Класс ручной загрузки списка естественных монополий из файла Excel или CSV пачками """
+
+    def __init__(self, session, batch_size: int = 1000, history=None):
+        self.session = session
+        self.batch_size = batch_size
+        # Версии загруженных записей в monopoly_history открываются с момента начала загрузки
+        self.history = history
+        self.started = datetime.now()
+        self.stats = {'rows': 0, 'skipped': 0}
+
+    def read(self, file: IO, filename: str = '') -> Iterator[tuple]:
+        """ Выбираем способ чтения по расширению файла """
+        if filename.lower().endswith(('.csv', '.txt')):
+            return read_csv(file)
+        return read_xlsx(file)
+
+    def _convert_value(self, key: str, value):
+        """ Приводим значение ячейки к типу поля базы данных """
+        if key == 'inn':
+            return '' if value is None else str(value).strip()
+        if key == 'dateFirstReg':
+            if isinstance(value, datetime):
+                return value.date()
+            if isinstance(value, date) or value is None:
+                return value
+            value = str(value).strip()
+            return parse_date(value) if value else None
+        if key == 'manualUpload':
+            return True
+        return value
+
+    def records(self, rows: Iterable) -> Iterator[dict]:
+        """
+        Проверяем заголовки файла и формируем для каждой строки отдельный словарь для записи в базу данных.
+        В случае отсутствия какой либо колонки в файле на месте отсутствующих значений будет записан null.
+        Если отсутствует ИНН выполнение остановится с ошибкой
+        """
+        rows = iter(rows)
+        header = [str(column).strip() if column is not None else None for column in next(rows, ())]
+        # Пустые колонки в конце листа не считаются заголовками
+        while header and header[-1] is None:
+            header.pop()
+        if not header or any(column not in DB_FIELDS for column in header) or 'inn' not in header:
+            LOGGER.info('Incorrect headers in excel file')
+            raise _upload_exception()
+
+        for row in rows:
+            values = list(row)[:len(header)]
+            if all(value is None or str(value).strip() == '' for value in values):
+                continue
+            values += [None] * (len(header) - len(values))
+            try:
+                record = {key: self._convert_value(key, value) for key, value in zip(header, values)}
+            except ValueError:
+                LOGGER.info('Error parse row: %s', values)
+                raise _upload_exception()
+            record['manualUpload'] = True
+
+            inn = record['inn']
+            if inn == '':
+                LOGGER.info('Blank INN field')
+                raise _upload_exception()
+
+            # Проверяем что ИНН похож на правильный
+            if len(inn) != 10 and len(inn) != 12:
+                LOGGER.info(f'Error len INN != 10 or != 12 {inn}')
+                self.stats['skipped'] += 1
+                continue
+
+            yield record
+
+    def _write_batch(self, batch: dict):
+        """ Записываем пачку одним INSERT ... ON CONFLICT DO UPDATE """
+        if not batch:
+            return
+        rows = list(batch.values())
+        stmt = upsert_statement(self.session, [key for key in rows[0] if key != 'inn'])
+        self.session.execute(stmt, rows)
+        if self.history is not None:
+            # Загрузка не меняет removeDate: исключённые из списка компании остаются исключёнными,
+            # и открытая версия (validTo NULL) для них показывала бы компанию в списке
+            active = set(self.session.execute(
+                select(tables.Monopoly.inn)
+                .where(tables.Monopoly.inn.in_(batch))
+                .where(tables.Monopoly.removeDate == None)
+            ).scalars())
+            self.history.replace([row for row in rows if row['inn'] in active], self.started)
+        self.stats['rows'] += len(rows)
+
+    def apply(self, records: Iterable[dict]):
+        """ Записываем данные пачками по batch_size. Фиксирует транзакцию вызывающий код """
+        batch = {}
+        for record in records:
+            # В одной пачке ИНН должен встречаться один раз, побеждает последняя строка файла
+            batch[record['inn']] = record
+            if len(batch) >= self.batch_size:
+                self._write_batch(batch)
+                batch = {}
+        self._write_batch(batch)
+        return self.stats
@@ -1,25 +1,103 @@
-import os, logging
+import os, atexit, copy, json, logging, queue
 from pydantic import BaseSettings
-from logging.handlers import TimedRotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
 
 
 class Settings(BaseSettings):
     log_level: str = 'DEBUG'
+    # Запись в файл в формате JSON (одна запись на строку)
+    log_json: bool = False
+    # Отладочная запись каждой N-й строки реестра при разборе (0 - не записывать)
+    log_row_sample: int = 0
 
     server_host: str = '127.0.0.1'
     server_port: int = 8004
+    # Рабочий режим python -m app: несколько процессов без перезагрузки по изменению файлов.
+    # По умолчанию - режим разработки (один процесс с reload)
+    server_production: bool = False
+    server_workers: int = 1
+    # auto - uvloop и httptools, если они установлены; иначе asyncio и h11
+    server_loop: str = 'auto'
+    server_http: str = 'auto'
+    # Время жизни простаивающего keep-alive соединения, с. Должно быть больше, чем у шлюза перед сервисом,
+    # иначе сервис закрывает соединение, которое шлюз считает открытым
+    server_keep_alive: int = 65
+    # Очередь входящих соединений сокета (listen backlog)
+    server_backlog: int = 2048
 
     database_url: str = ''
+    # Адрес для асинхронного движка, по умолчанию получается из database_url заменой драйвера на asyncpg
+    async_database_url: str = ''
+    # Пул соединений каждого движка (синхронного и асинхронного) в каждом процессе
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_pool_timeout: float = 30
+    db_pool_recycle: int = 1800
+    db_pool_pre_ping: bool = True
+    # Таймаут выполнения запроса на стороне PostgreSQL, мс (0 - без ограничения)
+    db_statement_timeout: int = 0
 
     bl_auth_url: str = ''
     bl_auth_verify_url: str = ''
     bl_auth_user: str = ''
     bl_auth_password: str = ''
+    auth_timeout: float = 5
+    auth_pool_size: int = 10
+    auth_cache_size: int = 10000
+    auth_cache_ttl: int = 300
+    auth_negative_ttl: int = 30
+    auth_service_token_ttl: int = 300
+    auth_service_token_margin: int = 60
 
     cookies_url_fas: str = ''
     url_fas: str = ''
+    fas_chunk_size: int = 65536
+    fas_spool_size: int = 8 * 1024 * 1024
+    fas_connect_timeout: float = 10
+    fas_read_timeout: float = 120
+    fas_retries: int = 3
+    fas_backoff: float = 1.0
+    fas_pool_size: int = 4
+    # Загрузка реестра частями по регионам (и типам реестра) в fas_partition_workers потоках вместо одного запроса
+    fas_partitioned: bool = False
+    fas_partition_by_type: bool = False
+    fas_partition_workers: int = 4
+    fas_partition_retries: int = 2
+    # Часть считается неполной, если в ней меньше этой доли компаний, которые были в ней в текущем списке
+    fas_partition_min_share: float = 0.5
 
     scheduler_period: int = 86400
+    scheduler_in_app: bool = True
+    worker_poll_interval: int = 10
+    reconcile_chunk_size: int = 1000
+    # Разбор таблицы в нескольких процессах (0 или 1 - в текущем процессе) фрагментами по parser_fragment_size байт
+    parser_workers: int = 0
+    parser_fragment_size: int = 4 * 1024 * 1024
+
+    cache_size: int = 10000
+    cache_ttl: int = 300
+    snapshot_enabled: bool = False
+    # Файл поиска по ИНН (mmap, общий для воркеров и пакетных задач); пусто - не используется.
+    # Записывается после каждого обновления списка, воркеры проверяют его замену раз в lookup_file_check_interval с
+    lookup_file: str = ''
+    lookup_file_check_interval: float = 1.0
+    # Сколько секунд шлюз и браузер могут использовать ответ monopoly_check без повторной проверки ETag
+    check_max_age: int = 60
+
+    batch_chunk_size: int = 1000
+    batch_max_size: int = 100000
+
+    upload_batch_size: int = 1000
+
+    export_chunk_size: int = 5000
+
+    # auto - pg_trgm в PostgreSQL, индекс в памяти для остальных баз и в режиме снимка (snapshot_enabled);
+    # trgm или memory - принудительно
+    search_backend: str = 'auto'
+    search_threshold: float = 0.6
+    search_max_size: int = 100
+    # Строить индекс поиска в памяти при запуске и после обновления, а не при первом поиске
+    search_preload: bool = False
 
 
 settings = Settings(
@@ -35,6 +113,40 @@ log_file = TimedRotatingFileHandler(file, when='midnight', encoding='UTF-8')
 log_file.suffix = "%Y-%m-%d_%H-%M-%S"
 log_file.namer = lambda name: name.replace(".log", "") + ".log"
 
+
+class JsonFormatter(logging.Formatter):
+    """ Запись журнала одной строкой JSON """
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'name': record.name,
+            'file': record.filename,
+            'line': record.lineno,
+            'func': record.funcName,
+            'message': record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exc'] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class LogQueueHandler(QueueHandler):
+    """
+    Очередь записей журнала внутри процесса. В потоке вызова только подставляются аргументы сообщения,
+    форматирование и запись в файл выполняет поток QueueListener
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
 if settings.log_level == 'DEBUG':
     log_msg_format = '%(asctime)s | %(name)s [%(levelname)s]: (%(filename)s,%(lineno)d).%(funcName)s - %(message)s'
     exc_info = True
@@ -42,5 +154,13 @@ else:
     log_msg_format = '%(asctime)s [%(levelname)s]: %(message)s'
     exc_info = False
 
-logging.basicConfig(handlers=(log_file,), format=log_msg_format, level=settings.log_level)
+log_file.setFormatter(JsonFormatter() if settings.log_json else logging.Formatter(log_msg_format))
+
+# Запись в файл выполняется в отдельном потоке: вызовы LOGGER только кладут запись в очередь
+log_queue = queue.SimpleQueue()
+log_listener = QueueListener(log_queue, log_file, respect_handler_level=True)
+log_listener.start()
+atexit.register(log_listener.stop)
+
+logging.basicConfig(handlers=(LogQueueHandler(log_queue),), level=settings.log_level)
 LOGGER = logging.getLogger(__name__)
@@ -1,4 +1,4 @@
-from sqlalchemy import (Column, Date, Integer, String, MetaData, DateTime, Boolean)
+from sqlalchemy import (Column, Date, Integer, String, MetaData, DateTime, Boolean, Index)
 from sqlalchemy.ext.declarative import declarative_base
 
 
@@ -36,3 +36,67 @@ class Monopoly(Base):
     lastCheck = Column(DateTime)
     removeDate = Column(DateTime)
     manualUpload = Column(Boolean, default=None)
+
+
+# Проверка по текущему списку (inn = ... AND removeDate IS NULL) идёт по уникальному индексу uq__monopoly__inn:
+# не больше одной строки, removeDate проверяется в ней. Отдельный частичный индекс по inn только замедлял бы запись
+
+# Частичный индекс для поиска исключённых из списка компаний (MonopolyReconciler.sweep)
+Index(
+    'ix__monopoly__lastCheck_sweep', Monopoly.lastCheck,
+    postgresql_where=Monopoly.removeDate.is_(None) & Monopoly.manualUpload.isnot(True),
+    sqlite_where=Monopoly.removeDate.is_(None) & Monopoly.manualUpload.isnot(True),
+)
+
+# GIN индекс pg_trgm для поиска по companyName, address, region (ix__monopoly__search_trgm) создают миграции
+# 5d8e1a4b7c92 и e4b8d1f6a273 только в PostgreSQL; в остальных базах поиск идёт по индексу в памяти (services.search)
+
+
+class MonopolyHistory(Base):
+    """ Версии записей списка: период validFrom - validTo, в который компания была в списке с этими данными """
+    __tablename__ = 'monopoly_history'
+    __table_args__ = (
+        Index('ix__monopoly_history__inn_validFrom_validTo', 'inn', 'validFrom', 'validTo'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    inn = Column(String(12), nullable=False)
+    companyName = Column(String(512))
+    registry = Column(String(512))
+    section = Column(String(512))
+    docNumber = Column(String(13))
+    region = Column(String(512))
+    address = Column(String(512))
+    dateFirstReg = Column(Date)
+    manualUpload = Column(Boolean, default=None)
+    validFrom = Column(DateTime, nullable=False)
+    validTo = Column(DateTime)
+
+
+class MonopolyRefresh(Base):
+    __tablename__ = 'monopoly_refresh'
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(String(16))
+    status = Column(String(16))
+    error = Column(String(512))
+    createdAt = Column(DateTime)
+    startedAt = Column(DateTime)
+    finishedAt = Column(DateTime)
+    etag = Column(String(256))
+    lastModified = Column(String(64))
+    bodyHash = Column(String(64))
+    rows = Column(Integer)
+    inserted = Column(Integer)
+    updated = Column(Integer)
+    touched = Column(Integer)
+    removed = Column(Integer)
+
+
+# Не больше одного ожидающего или выполняемого задания каждого вида: RefreshJobs.enqueue из нескольких
+# процессов не ставит обновление дважды (в SQLite advisory lock нет, запрос API выполняется без блокировки)
+Index(
+    'ix__monopoly_refresh__kind_active', MonopolyRefresh.kind, unique=True,
+    postgresql_where=MonopolyRefresh.status.in_(('queued', 'running')),
+    sqlite_where=MonopolyRefresh.status.in_(('queued', 'running')),
+)
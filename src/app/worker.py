@@ -0,0 +1,27 @@
+import time
+from .database import Session, engine
+from .services.jobs import RefreshJobs
+from .settings import LOGGER, settings
+
+
+def main():
+    """
+    Отдельный процесс обновления списка естественных монополий с сайта ФАС: python -m app.worker
+
+    Выполняет плановые обновления раз в scheduler_period и задания, поставленные через POST /api/v1/monopoly_update.
+    Воркерам API в этом случае задаётся SCHEDULER_IN_APP=false
+    """
+    LOGGER.info('Refresh worker started')
+    while True:
+        session = Session()
+        try:
+            RefreshJobs(session).run_pending(engine)
+        except Exception:
+            LOGGER.exception('Refresh worker iteration failed')
+        finally:
+            session.close()
+        time.sleep(settings.worker_poll_interval)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+"""
+Нагрузочный сценарий для /api/v1/monopoly_check: задержка p50/p90/p99 и количество запросов в секунду.
+
+Генератор открывает --concurrency постоянных HTTP/1.1 соединений (asyncio, без сторонних библиотек) и в течение
+--duration секунд запрашивает ИНН из базы (доля --hit-ratio) и несуществующие ИНН (ответ 404).
+
+Против запущенного сервиса:
+
+    cd src && DATABASE_URL=... python -m benchmarks.bench_check --url http://127.0.0.1:8004 --concurrency 64
+
+Или с запуском uvicorn на свободном порту (база - DATABASE_URL, заполнить её можно benchmarks.bench_refresh):
+
+    cd src && DATABASE_URL=sqlite:////tmp/bench.sqlite python -m benchmarks.bench_check --spawn --workers 2
+
+С --revalidate клиенты повторяют запросы с If-None-Match по ETag предыдущего ответа (как кэширующий шлюз).
+"""
+import argparse, asyncio, os, random, socket, subprocess, sys, time
+from collections import Counter
+from urllib.parse import urlsplit
+from app import tables
+from app.database import Session
+
+
+def sample_inns(limit: int):
+    session = Session()
+    try:
+        return [inn for inn, in session.query(tables.Monopoly.inn).filter(tables.Monopoly.removeDate == None)
+                .limit(limit)]
+    finally:
+        session.close()
+
+
+def request_paths(inns, hit_ratio: float, count: int = 100000):
+    rng = random.Random(0)
+    paths = []
+    for _ in range(count):
+        if inns and rng.random() < hit_ratio:
+            inn = rng.choice(inns)
+        else:
+            inn = str(rng.randint(9000000000, 9999999999))
+        paths.append(f'/api/v1/monopoly_check?inn={inn}')
+    return paths
+
+
+async def read_response(reader) -> (int, str):
+    """ Читаем ответ целиком, возвращаем код статуса и ETag """
+    status = int((await reader.readline()).split()[1])
+    length, chunked, etag = 0, False, None
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        name = name.strip().lower()
+        if name == 'content-length':
+            length = int(value)
+        elif name == 'transfer-encoding' and 'chunked' in value:
+            chunked = True
+        elif name == 'etag':
+            etag = value.strip()
+    if chunked:
+        while True:
+            size = int((await reader.readline()).strip(), 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    else:
+        await reader.readexactly(length)
+    return status, etag
+
+
+async def client(number: int, host: str, port: int, paths, start: float, deadline: float, latencies: list,
+                 statuses: Counter, etags: dict = None):
+    """ etags - ETag ответов по пути запроса: если передан, клиент перепроверяет ответы через If-None-Match """
+    reader, writer = await asyncio.open_connection(host, port)
+    rng = random.Random(number)
+    try:
+        while True:
+            path = paths[rng.randrange(len(paths))]
+            started = time.perf_counter()
+            if started >= deadline:
+                break
+            conditional = ''
+            if etags is not None and path in etags:
+                conditional = f'If-None-Match: {etags[path]}\r\n'
+            writer.write(f'GET {path} HTTP/1.1\r\nHost: {host}\r\n{conditional}\r\n'.encode('latin-1'))
+            status, etag = await read_response(reader)
+            finished = time.perf_counter()
+            if etags is not None and etag is not None:
+                etags[path] = etag
+            # Запросы до окончания прогрева не учитываются
+            if started >= start:
+                latencies.append(finished - started)
+                statuses[status] += 1
+    finally:
+        writer.close()
+
+
+async def load(host: str, port: int, paths, concurrency: int, duration: float, warmup: float, revalidate: bool):
+    latencies, statuses = [], Counter()
+    start = time.perf_counter() + warmup
+    deadline = start + duration
+    # Общий словарь ETag - как кэш шлюза перед сервисом
+    etags = {} if revalidate else None
+    await asyncio.gather(*(
+        client(number, host, port, paths, start, deadline, latencies, statuses, etags) for number in range(concurrency)
+    ))
+    return latencies, statuses
+
+
+def percentile(values, share: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def spawn(port: int, workers: int) -> subprocess.Popen:
+    """ Запускаем сервис в отдельном процессе и ждём, пока он начнёт отвечать """
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'app.app:app', '--host', '127.0.0.1', '--port', str(port),
+         '--workers', str(workers), '--no-access-log', '--log-level', 'warning'],
+        env={**os.environ, 'SCHEDULER_IN_APP': 'false'},
+    )
+    for _ in range(300):
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.1):
+                return process
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError('Service did not start')
+
+
+def main():
+    arguments = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arguments.add_argument('--url', default='http://127.0.0.1:8004')
+    arguments.add_argument('--spawn', action='store_true', help='запустить uvicorn app.app:app на свободном порту')
+    arguments.add_argument('--workers', type=int, default=1)
+    arguments.add_argument('--concurrency', type=int, default=32)
+    arguments.add_argument('--duration', type=float, default=10)
+    arguments.add_argument('--warmup', type=float, default=2)
+    arguments.add_argument('--hit-ratio', type=float, default=0.8, help='доля ИНН, которые есть в базе')
+    arguments.add_argument('--revalidate', action='store_true',
+                           help='повторные запросы с If-None-Match (ответ 304), как через кэширующий шлюз')
+    args = arguments.parse_args()
+
+    paths = request_paths(sample_inns(100000), args.hit_ratio)
+    process = None
+    if args.spawn:
+        host, port = '127.0.0.1', free_port()
+        process = spawn(port, args.workers)
+    else:
+        url = urlsplit(args.url)
+        host, port = url.hostname, url.port or 80
+    try:
+        latencies, statuses = asyncio.run(load(host, port, paths, args.concurrency, args.duration, args.warmup,
+                                                  args.revalidate))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    latencies.sort()
+    if not latencies:
+        print('no responses')
+        return
+    print(f'requests {len(latencies)}, {len(latencies) / args.duration:,.0f} req/s, concurrency {args.concurrency}')
+    print('latency ms: p50 {:.2f}  p90 {:.2f}  p99 {:.2f}  max {:.2f}'.format(
+        *(percentile(latencies, share) * 1000 for share in (0.5, 0.9, 0.99)), latencies[-1] * 1000))
+    print('status: ' + ', '.join(f'{status} x{count}' for status, count in sorted(statuses.items())))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Микро-бенчмарк извлечения строк таблицы реестра ФАС.
+
+Сравнивает прежний способ (девять вызовов item.xpath на строку, re.compile и strptime в цикле)
+с RowExtractor на сохранённой копии страницы ФАС:
+
+    cd src && python -m benchmarks.bench_extractor path/to/fas_page.html [--repeat 5]
+"""
+import argparse, re, time
+from datetime import datetime
+from lxml import etree
+from app.services.extractor import RowExtractor
+
+
+def legacy_extract(item):
+    """ Извлечение строки в том виде, в каком оно было в parser_monopoly """
+    company_name = item.xpath('.//td[5]/text()')[0]
+    registry = item.xpath('.//td[1]/text()')[0]
+    section = item.xpath('.//td[2]/text()')[0]
+    doc_number = item.xpath('.//td[3]/text()')[0]
+    region = item.xpath('.//td[4]/text()')[0]
+    address = item.xpath('.//td[7]/text()')[0]
+    order_date = item.xpath('.//td[9]/text()')[0]
+    inn_raw = item.xpath('.//td[6]/nobr/div[contains(text(), "ИНН")]/text()')
+    if len(inn_raw) == 0:
+        return None
+    inn = re.sub(re.compile(r'(^\w+:\s*)'), '', inn_raw[0])
+    if ((len(inn) == 10) | (len(inn) == 12)) is False:
+        return None
+    return {
+        'inn': inn,
+        'companyName': company_name,
+        'registry': registry,
+        'section': section,
+        'docNumber': doc_number,
+        'region': region,
+        'address': address,
+        'dateFirstReg': datetime.strptime(order_date, "%d.%m.%Y").date(),
+    }
+
+
+def measure(extract, rows, repeat: int) -> float:
+    """ Лучшее время обработки всех строк из repeat прогонов """
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for row in rows:
+            extract(row)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    arguments = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arguments.add_argument('page', help='сохранённая HTML страница с таблицей реестра ФАС')
+    arguments.add_argument('--repeat', type=int, default=5)
+    args = arguments.parse_args()
+
+    tree = etree.parse(args.page, etree.HTMLParser())
+    rows = tree.xpath('//tbody/tr')
+    extractor = RowExtractor()
+
+    # Оба способа должны давать одинаковый результат
+    for row in rows:
+        assert legacy_extract(row) == extractor.extract(row)
+
+    for name, extract in (('xpath (before)', legacy_extract), ('RowExtractor (after)', extractor.extract)):
+        elapsed = measure(extract, rows, args.repeat)
+        print(f'{name:<22} {len(rows)} rows  {elapsed:.4f} s  {len(rows) / elapsed:,.0f} rows/s')
+
+
+if __name__ == '__main__':
+    main()
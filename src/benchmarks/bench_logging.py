@@ -0,0 +1,82 @@
+"""
+Бенчмарк разбора страницы реестра ФАС с включённым и выключенным журналированием.
+
+Разбирает синтетическую страницу (или сохранённую копию) тем же кодом, что и parser_monopoly, без записи в базу:
+
+- off - отладочная запись строк выключена (log_row_sample=0)
+- sync - каждая строка пишется в файл синхронно, как было до QueueHandler
+- queue - каждая строка пишется через QueueHandler/QueueListener
+- sampled - через очередь пишется каждая 1000-я строка
+
+    cd src && DATABASE_URL=sqlite:// python -m benchmarks.bench_logging [--rows 20000] [--page page.html]
+"""
+import argparse, io, logging, os, queue, tempfile, time
+from logging.handlers import QueueListener
+from app.services.parser import MonopolyParser
+from app.settings import settings, JsonFormatter, LogQueueHandler, log_msg_format
+from .fas_page import synthetic_page
+
+
+def parse(page: bytes) -> int:
+    """ Разбираем страницу и возвращаем количество извлечённых строк """
+    parser = MonopolyParser(session=None)
+    return sum(1 for _ in parser._parse_rows(parser._iter_table_rows(io.BytesIO(page), 'utf-8'), None))
+
+
+def run(page: bytes, mode: str, formatter: logging.Formatter, path: str) -> float:
+    root = logging.getLogger()
+    saved_handlers, saved_level, saved_sample = root.handlers[:], root.level, settings.log_row_sample
+    file_handler = logging.FileHandler(path, encoding='UTF-8')
+    file_handler.setFormatter(formatter)
+    listener = None
+    if mode == 'sync':
+        handler = file_handler
+    else:
+        log_queue = queue.SimpleQueue()
+        listener = QueueListener(log_queue, file_handler)
+        listener.start()
+        handler = LogQueueHandler(log_queue)
+    root.handlers = [handler]
+    root.setLevel(logging.DEBUG)
+    settings.log_row_sample = {'off': 0, 'sync': 1, 'queue': 1, 'sampled': 1000}[mode]
+    try:
+        started = time.perf_counter()
+        parse(page)
+        elapsed = time.perf_counter() - started
+        if listener is not None:
+            # Время дозаписи очереди в файл не входит в время разбора
+            listener.stop()
+    finally:
+        root.handlers, settings.log_row_sample = saved_handlers, saved_sample
+        root.setLevel(saved_level)
+        file_handler.close()
+    return elapsed
+
+
+def main():
+    arguments = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arguments.add_argument('--rows', type=int, default=20000)
+    arguments.add_argument('--page', help='сохранённая страница ФАС вместо синтетической')
+    arguments.add_argument('--repeat', type=int, default=3)
+    arguments.add_argument('--json', action='store_true', help='формат JSON вместо текстового')
+    args = arguments.parse_args()
+
+    if args.page:
+        with open(args.page, 'rb') as file:
+            page = file.read()
+    else:
+        page = synthetic_page(args.rows)
+    rows = parse(page)
+    formatter = JsonFormatter() if args.json else logging.Formatter(log_msg_format)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.log')
+        baseline = None
+        for mode in ('off', 'sync', 'queue', 'sampled'):
+            best = min(run(page, mode, formatter, path) for _ in range(args.repeat))
+            baseline = baseline or best
+            print(f'{mode:8} {best:8.3f} s  {rows / best:10.0f} rows/s  x{best / baseline:.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Проверка по ИНН через файл поиска (LOOKUP_FILE, mmap) в сравнении со снимком в памяти и запросом к базе.
+
+Печатает время записи файла, его размер, память снимка одного процесса (в каждом воркере uvicorn - своя копия,
+страницы файла общие) и время одной проверки для ИНН из списка и отсутствующих:
+
+    cd src && DATABASE_URL=sqlite:////tmp/bench.sqlite python -m benchmarks.bench_lookup --path /tmp/monopoly.lookup
+
+Сквозная проверка с несколькими воркерами: LOOKUP_FILE=/tmp/monopoly.lookup python -m benchmarks.bench_check --spawn
+"""
+import argparse, os, random, time, tracemalloc
+from app.database import Session
+from app.services.lookup_file import LookupFile, write_lookup_file
+from app.services.monopoly import company_query, encode, registry_version, to_dict
+from app.services.snapshot import MonopolySnapshot
+from .bench_check import sample_inns
+
+
+def measure(name: str, check, inns):
+    started = time.perf_counter()
+    for inn in inns:
+        check(inn)
+    elapsed = time.perf_counter() - started
+    print(f'{name:<10} {elapsed / len(inns) * 1e6:8.2f} us/lookup')
+
+
+def main():
+    arguments = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arguments.add_argument('--path', default='/tmp/monopoly.lookup')
+    arguments.add_argument('--lookups', type=int, default=100000)
+    arguments.add_argument('--db-lookups', type=int, default=5000)
+    args = arguments.parse_args()
+
+    session = Session()
+    try:
+        started = time.perf_counter()
+        rows = write_lookup_file(session, args.path, registry_version(session))
+        print(f'lookup file: {rows} rows, {os.path.getsize(args.path) / 1024 / 1024:.1f} MB, '
+              f'written in {time.perf_counter() - started:.2f} s')
+
+        started = time.perf_counter()
+        lookup = LookupFile(args.path)
+        print(f'lookup file opened in {(time.perf_counter() - started) * 1000:.2f} ms')
+
+        tracemalloc.start()
+        started = time.perf_counter()
+        snapshot = MonopolySnapshot.load(session)
+        loaded = time.perf_counter() - started
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print(f'snapshot:    {len(snapshot)} rows, {memory / 1024 / 1024:.1f} MB per process, loaded in {loaded:.2f} s')
+
+        rng = random.Random(0)
+        known = sample_inns(100000)
+        inns = [rng.choice(known) if rng.random() < 0.8 else str(rng.randint(9000000000, 9999999999))
+                for _ in range(args.lookups)]
+
+        def database(inn):
+            company = session.execute(company_query(inn, False)).scalars().first()
+            return encode(to_dict(company)) if company is not None else None
+
+        measure('database', database, inns[:args.db_lookups])
+        measure('snapshot', lambda inn: encode(snapshot.get(inn, False)), inns)
+        measure('file', lambda inn: lookup.find(inn, False), inns)
+        measure('file dict', lambda inn: lookup.get(inn, False), inns)
+    finally:
+        session.close()
+
+
+if __name__ == '__main__':
+    main()
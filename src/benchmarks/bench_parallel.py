@@ -0,0 +1,64 @@
+"""
+Бенчмарк разбора таблицы реестра ФАС в нескольких процессах (настройка parser_workers).
+
+Разбирает синтетическую страницу (или сохранённую копию) последовательно и в пуле из 2, 4, ... процессов
+до --max-workers (по умолчанию - количество ядер) и печатает ускорение относительно последовательного разбора:
+
+    cd src && DATABASE_URL=sqlite:// python -m benchmarks.bench_parallel --rows 300000 [--fragment-size 4194304]
+"""
+import argparse, os, tempfile, time
+from app.services.parser import MonopolyParser
+from app.settings import settings
+from .fas_page import write_page
+
+
+def parse(path: str, workers: int) -> (int, float):
+    settings.parser_workers = workers
+    parser = MonopolyParser(session=None)
+    started = time.perf_counter()
+    with open(path, 'rb') as body:
+        if workers > 1:
+            rows = sum(1 for _ in parser._parse_rows_parallel(body, 'utf-8', None))
+        else:
+            rows = sum(1 for _ in parser._parse_rows(parser._iter_table_rows(body, 'utf-8'), None))
+    return rows, time.perf_counter() - started
+
+
+def main():
+    arguments = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arguments.add_argument('--rows', type=int, default=300000)
+    arguments.add_argument('--page', help='сохранённая страница ФАС вместо синтетической')
+    arguments.add_argument('--max-workers', type=int, default=os.cpu_count())
+    arguments.add_argument('--fragment-size', type=int, default=settings.parser_fragment_size)
+    args = arguments.parse_args()
+    settings.parser_fragment_size = args.fragment_size
+
+    workers = [1]
+    while workers[-1] * 2 <= args.max_workers:
+        workers.append(workers[-1] * 2)
+    if workers[-1] != args.max_workers and args.max_workers > 1:
+        workers.append(args.max_workers)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = args.page
+        if path is None:
+            path = os.path.join(directory, 'fas.html')
+            write_page(path, args.rows)
+        print(f'{os.path.getsize(path) / 1024 / 1024:.1f} MB, {os.cpu_count()} CPU, '
+              f'fragment {settings.parser_fragment_size // 1024} KB')
+        baseline = None
+        for count in workers:
+            rows, elapsed = parse(path, count)
+            baseline = baseline or elapsed
+            mode = 'sequential' if count == 1 else f'{count} workers'
+            print(f'{mode:<12} {rows:>9} rows {elapsed:8.2f} s {rows / elapsed:>10,.0f} rows/s  x{baseline / elapsed:.2f}')
+        # Накладные расходы пула: деление на фрагменты и передача результатов между процессами
+        if args.max_workers == 1:
+            settings.parser_workers = 2
+            rows, elapsed = parse(path, 2)
+            print(f'{"2 workers":<12} {rows:>9} rows {elapsed:8.2f} s {rows / elapsed:>10,.0f} rows/s  '
+                  f'x{baseline / elapsed:.2f} (1 CPU)')
+
+
+if __name__ == '__main__':
+    main()
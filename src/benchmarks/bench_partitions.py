@@ -0,0 +1,70 @@
+"""
+Бенчмарк загрузки реестра одним запросом и частями по регионам (fas_partitioned) с локальной заглушкой сайта ФАС.
+
+Заглушка тратит на формирование ответа --row-delay секунд на строку, как сайт, который строит таблицу
+целиком перед отправкой: один запрос ждёт весь список, части формируются параллельно.
+Сценарии выполняются на одной базе из DATABASE_URL после первой загрузки списка:
+
+- single        - один запрос RegionID=0 с полной сверкой
+- regions xN    - части по регионам в N потоках
+- types x4      - части по регионам и типам реестра (fas_partition_by_type)
+- truncated     - первые две части обрываются на середине таблицы и запрашиваются повторно
+
+    cd src && DATABASE_URL=sqlite:////tmp/bench.sqlite python -m benchmarks.bench_partitions --rows 100000 --reset
+"""
+import argparse
+from app import tables
+from app.database import engine
+from app.settings import settings
+from .bench_refresh import forget_body_hash, refresh, reset
+from .fas_stub import FasStub, serve
+
+
+def report(name: str, result: dict):
+    timings = result['timings']
+    print(f'{name:<12} {result["seen"]:>9} rows {timings["total"]:8.2f} s  partitions {result["partitions"]:>3}  '
+          f'retries {result["retries"]}  +{result["inserted"]} ~{result["updated"]} ={result["touched"]} '
+          f'-{result["removed"]}  [stream {timings["stream"]:.2f}]')
+
+
+def run(name: str, partitioned: bool, workers: int = 4, by_type: bool = False):
+    settings.fas_partitioned = partitioned
+    settings.fas_partition_workers = workers
+    settings.fas_partition_by_type = by_type
+    forget_body_hash()
+    report(name, refresh())
+
+
+def main():
+    arguments = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arguments.add_argument('--rows', type=int, default=100000)
+    arguments.add_argument('--row-delay', type=float, default=0.00002, help='время формирования ответа на строку, с')
+    arguments.add_argument('--reset', action='store_true', help='очистить monopoly и monopoly_refresh перед запуском')
+    args = arguments.parse_args()
+
+    if engine.dialect.name == 'sqlite':
+        tables.metadata.create_all(engine)
+    if args.reset:
+        reset()
+
+    stub = FasStub(b'', row_delay=args.row_delay)
+    stub.set_registry(args.rows)
+    server = serve(stub)
+    base_url = 'http://127.0.0.1:%d/FindCem/' % server.server_address[1]
+    settings.cookies_url_fas, settings.url_fas = base_url, base_url + 'Find'
+    settings.fas_backoff = 0.1
+    print(f'{engine.dialect.name}, {args.rows} rows, {args.row_delay * args.rows:.1f} s to build the whole table')
+    try:
+        run('initial', partitioned=False)
+        run('single', partitioned=False)
+        for workers in (1, 2, 4, 8):
+            run(f'regions x{workers}', partitioned=True, workers=workers)
+        run('types x4', partitioned=True, by_type=True)
+        stub.truncate, stub.partition_requests = 2, 0
+        run('truncated', partitioned=True)
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
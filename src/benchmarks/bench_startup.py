@@ -0,0 +1,67 @@
+"""
+Время холодного запуска воркера API: импорт app.app в новом интерпретаторе и время от запуска uvicorn
+до первого ответа /metrics (после событий startup), а также какие тяжёлые зависимости загружены при запуске:
+
+    cd src && DATABASE_URL=sqlite:////tmp/bench.sqlite python -m benchmarks.bench_startup --repeat 5
+"""
+import argparse, json, os, statistics, subprocess, sys, time
+from urllib.error import URLError
+from urllib.request import urlopen
+from .bench_check import free_port
+
+# Зависимости разбора страницы ФАС и файлов загрузки, которые не нужны воркеру, обслуживающему проверки
+HEAVY = ('openpyxl', 'bs4', 'lxml', 'requests')
+
+IMPORT_SCRIPT = '''
+import json, sys, time
+started = time.perf_counter()
+import app.app
+print(json.dumps({'seconds': time.perf_counter() - started,
+                  'loaded': [name for name in %r if name in sys.modules]}))
+''' % (HEAVY,)
+
+
+def measure_import() -> dict:
+    output = subprocess.run([sys.executable, '-c', IMPORT_SCRIPT], check=True, capture_output=True, text=True)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def measure_first_response() -> float:
+    """ Запускаем uvicorn и ждём первого успешного ответа """
+    port = free_port()
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'app.app:app', '--host', '127.0.0.1', '--port', str(port),
+         '--log-level', 'warning'],
+        env={**os.environ, 'SCHEDULER_IN_APP': 'false'},
+    )
+    try:
+        while True:
+            try:
+                with urlopen(f'http://127.0.0.1:{port}/metrics', timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - started
+            except (URLError, ConnectionError):
+                if process.poll() is not None:
+                    raise RuntimeError('Service did not start')
+                time.sleep(0.005)
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    arguments = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arguments.add_argument('--repeat', type=int, default=5)
+    args = arguments.parse_args()
+
+    imports = [measure_import() for _ in range(args.repeat)]
+    print(f'import app.app: median {statistics.median(item["seconds"] for item in imports) * 1000:.0f} ms, '
+          f'heavy modules loaded: {", ".join(imports[-1]["loaded"]) or "none"}')
+    starts = [measure_first_response() for _ in range(args.repeat)]
+    print(f'uvicorn start to first response: median {statistics.median(starts) * 1000:.0f} ms, '
+          f'min {min(starts) * 1000:.0f} ms, max {max(starts) * 1000:.0f} ms')
+
+
+if __name__ == '__main__':
+    main()
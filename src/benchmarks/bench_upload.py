@@ -0,0 +1,87 @@
+"""
+Бенчмарк ручной загрузки списка монополий (manual_file_upload).
+
+Загружает monopoly_manual_upload.xlsx из корня репозитория и синтетические файлы на --rows строк (CSV и XLSX)
+в базу из DATABASE_URL. Для SQLite таблицы создаются автоматически:
+
+    cd src && DATABASE_URL=sqlite:////tmp/bench.sqlite python -m benchmarks.bench_upload --rows 500000
+"""
+import argparse, csv, os, tempfile, time
+from openpyxl import Workbook
+from app import tables
+from app.database import Session, engine
+from app.services.parser import MonopolyParser
+
+SAMPLE = os.path.join(os.path.dirname(__file__), '..', '..', 'monopoly_manual_upload.xlsx')
+HEADER = ['inn', 'registry', 'region', 'companyName', 'address', 'dateFirstReg', 'section', 'docNumber']
+
+
+def synthetic_rows(rows: int):
+    for number in range(rows):
+        yield [
+            str(5000000000 + number),
+            'Реестр субъектов естественных монополий в топливно-энергетическом комплексе',
+            'Республика Коми',
+            f'ООО «Компания {number}»',
+            f'167981, г. Сыктывкар, ул. Красных Партизан, {number}',
+            '14.11.1997',
+            'Раздел II «Транспортировка газа по трубопроводам»',
+            f'11.2.{number}',
+        ]
+
+
+def write_csv(path: str, rows: int):
+    with open(path, 'w', encoding='utf-8', newline='') as file:
+        writer = csv.writer(file, delimiter=';')
+        writer.writerow(HEADER)
+        writer.writerows(synthetic_rows(rows))
+
+
+def write_xlsx(path: str, rows: int):
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(HEADER)
+    for row in synthetic_rows(rows):
+        sheet.append(row)
+    workbook.save(path)
+
+
+def upload(path: str):
+    session = Session()
+    try:
+        started = time.perf_counter()
+        with open(path, 'rb') as file:
+            MonopolyParser(session).monopoly_upload(file, os.path.basename(path))
+        return time.perf_counter() - started
+    finally:
+        session.close()
+
+
+def main():
+    arguments = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arguments.add_argument('--rows', type=int, default=500000)
+    arguments.add_argument('--skip-xlsx', action='store_true', help='не генерировать синтетический XLSX (долго)')
+    args = arguments.parse_args()
+
+    if engine.dialect.name == 'sqlite':
+        tables.metadata.create_all(engine)
+
+    with tempfile.TemporaryDirectory() as directory:
+        files = [('monopoly_manual_upload.xlsx', SAMPLE, None)]
+        csv_path = os.path.join(directory, 'synthetic.csv')
+        write_csv(csv_path, args.rows)
+        files.append(('synthetic.csv', csv_path, args.rows))
+        if not args.skip_xlsx:
+            xlsx_path = os.path.join(directory, 'synthetic.xlsx')
+            write_xlsx(xlsx_path, args.rows)
+            files.append(('synthetic.xlsx', xlsx_path, args.rows))
+
+        for name, path, rows in files:
+            elapsed = upload(path)
+            size = os.path.getsize(path) / 1024 / 1024
+            rate = f'{rows / elapsed:,.0f} rows/s' if rows else ''
+            print(f'{name:<28} {size:8.1f} MB  {elapsed:8.2f} s  {rate}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+"""
+Генератор синтетических страниц реестра ФАС в разметке, которую разбирает parser_monopoly:
+строки //tbody/tr с ячейками td[1..9], ИНН в td[6]/nobr/div вместе с ОГРН и ОКПО.
+
+Страница на 1 000 000 строк занимает ~600 МБ, поэтому она формируется по частям (iter_page)
+и при необходимости сразу пишется в файл:
+
+    cd src && python -m benchmarks.fas_page --rows 1000000 --out /tmp/fas_1m.html [--revision 1]
+
+revision > 0 - следующая версия списка: у части компаний меняется адрес, часть исключается, добавляются новые.
+"""
+import argparse, random
+from typing import Iterator
+
+REGISTRIES = (
+    'Реестр субъектов естественных монополий в топливно-энергетическом комплексе',
+    'Реестр субъектов естественных монополий на транспорте',
+    'Реестр субъектов естественных монополий в сфере связи',
+    'Реестр субъектов естественных монополий в сфере водоснабжения и водоотведения',
+)
+
+SECTIONS = (
+    'Раздел I «Транспортировка нефти и нефтепродуктов по магистральным трубопроводам»',
+    'Раздел II «Транспортировка газа по трубопроводам»',
+    'Раздел III «Услуги по передаче электрической и тепловой энергии»',
+    'Раздел IV «Услуги в портах и транспортных терминалах»',
+)
+
+REGIONS = (
+    'г. Москва', 'г. Санкт-Петербург', 'Московская область', 'Республика Коми', 'Республика Татарстан',
+    'Краснодарский край', 'Свердловская область', 'Новосибирская область', 'Приморский край', 'Ямало-Ненецкий АО',
+)
+
+LEGAL_FORMS = ('ООО', 'АО', 'ПАО', 'МУП', 'ГУП', 'ОАО', 'ЗАО')
+
+HEAD = (
+    '<!DOCTYPE html><html><head><meta charset="utf-8"><title>Реестр</title></head><body>'
+    '<table class="table"><thead><tr><th>Реестр</th><th>Раздел</th><th>Номер</th><th>Регион</th>'
+    '<th>Наименование</th><th>Реквизиты</th><th>Адрес</th><th>Приказ</th><th>Дата</th></tr></thead><tbody>'
+)
+
+TAIL = '</tbody></table></body></html>'
+
+# Доли строк, которые меняются в каждой следующей ревизии списка
+CHANGED_SHARE = 0.01
+DROPPED_SHARE = 0.002
+ADDED_SHARE = 0.002
+
+
+def inn_for(number: int) -> str:
+    """ Уникальный ИНН строки: каждая 20-я компания - ИП с 12-значным ИНН """
+    if number % 20 == 19:
+        return str(500000000000 + number)
+    return str(1000000000 + number)
+
+
+def row_html(number: int, revision: int = 0) -> str:
+    """ Одна строка таблицы. Значения детерминированы номером строки и ревизией """
+    rng = random.Random(number)
+    day, month, year = rng.randint(1, 28), rng.randint(1, 12), rng.randint(1995, 2021)
+    address = f'{rng.randint(100000, 199999)}, {REGIONS[number % len(REGIONS)]}, ул. Ленина, д. {number % 300}'
+    if revision and rng.random() < CHANGED_SHARE * revision:
+        address += f', корп. {revision}'
+    return (
+        f'<tr><td>{REGISTRIES[number % len(REGISTRIES)]}</td>'
+        f'<td>{SECTIONS[(number // 7) % len(SECTIONS)]}</td>'
+        f'<td>{number % 100}.{number // 100 % 1000}.{number}</td>'
+        f'<td>{REGIONS[number % len(REGIONS)]}</td>'
+        f'<td>{LEGAL_FORMS[number % len(LEGAL_FORMS)]} «Компания {number}»</td>'
+        f'<td><nobr><div>ИНН: {inn_for(number)}</div><div>ОГРН: {1020000000000 + number}</div>'
+        f'<div>ОКПО: {10000000 + number}</div></nobr></td>'
+        f'<td>{address}</td>'
+        f'<td>{number % 500}-э</td>'
+        f'<td>{day:02d}.{month:02d}.{year}</td></tr>'
+    )
+
+
+def row_numbers(rows: int, revision: int = 0) -> Iterator[int]:
+    """ Номера компаний в списке ревизии: часть исключается, в конец добавляются новые """
+    for number in range(rows):
+        if revision and random.Random(number ^ 0x5DEECE66D).random() < DROPPED_SHARE * revision:
+            continue
+        yield number
+    yield from range(rows, rows + int(rows * ADDED_SHARE * revision))
+
+
+def in_partition(number: int, region: int = 0, registry: int = 0) -> bool:
+    """ Строка попадает в выборку формы ФАС: region и registry - номера в REGIONS и REGISTRIES с 1, 0 - все """
+    return (not region or number % len(REGIONS) == region - 1) and \
+        (not registry or number % len(REGISTRIES) == registry - 1)
+
+
+def iter_page(rows: int, revision: int = 0, chunk_rows: int = 1000, region: int = 0,
+              registry: int = 0) -> Iterator[bytes]:
+    """ Страница реестра (или выборки по региону и типу реестра) частями по chunk_rows строк, в UTF-8 """
+    yield HEAD.encode('utf-8')
+    chunk = []
+    for number in row_numbers(rows, revision):
+        if not in_partition(number, region, registry):
+            continue
+        chunk.append(row_html(number, revision))
+        if len(chunk) >= chunk_rows:
+            yield ''.join(chunk).encode('utf-8')
+            chunk = []
+    yield (''.join(chunk) + TAIL).encode('utf-8')
+
+
+def synthetic_page(rows: int, revision: int = 0, region: int = 0, registry: int = 0) -> bytes:
+    """ Страница реестра целиком в памяти (для страниц до сотен тысяч строк) """
+    return b''.join(iter_page(rows, revision, region=region, registry=registry))
+
+
+def write_page(path: str, rows: int, revision: int = 0) -> int:
+    """ Записываем страницу в файл, возвращаем размер в байтах """
+    size = 0
+    with open(path, 'wb') as file:
+        for chunk in iter_page(rows, revision):
+            file.write(chunk)
+            size += len(chunk)
+    return size
+
+
+def main():
+    arguments = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arguments.add_argument('--rows', type=int, default=100000)
+    arguments.add_argument('--revision', type=int, default=0)
+    arguments.add_argument('--out', required=True)
+    args = arguments.parse_args()
+    size = write_page(args.out, args.rows, args.revision)
+    print(f'{args.out}: {size / 1024 / 1024:.1f} MB')
+
+
+if __name__ == '__main__':
+    main()
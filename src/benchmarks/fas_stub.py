@@ -0,0 +1,172 @@
+"""
+Локальная заглушка сайта ФАС для проверки загрузки реестра без обращения к apps.eias.fas.gov.ru.
+
+GET  /FindCem/      - страница с полем __RequestVerificationToken и списками RegionID, RegTypeID
+POST /FindCem/Find  - таблица реестра (сохранённая страница --page или синтетическая на --rows строк);
+                      для синтетической страницы учитываются фильтры RegionID и RegTypeID
+
+Страница из файла отдаётся потоком без сжатия, поэтому подходит для реестра на 1 000 000 строк
+(файл готовит python -m benchmarks.fas_page).
+
+    cd src && python -m benchmarks.fas_stub --rows 5000 --port 8090 [--delay 0.5] [--fail 2] [--truncate 1]
+
+Для приложения: COOKIES_URL_FAS=http://127.0.0.1:8090/FindCem/ URL_FAS=http://127.0.0.1:8090/FindCem/Find
+"""
+import argparse, gzip, os, shutil, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+from .fas_page import REGIONS, REGISTRIES, in_partition, row_numbers, synthetic_page
+
+TOKEN = 'stub-verification-token'
+
+
+def _select(name: str, values) -> str:
+    options = ''.join(f'<option value="{number}">{value}</option>' for number, value in enumerate(values, 1))
+    return f'<select name="{name}"><option value="0">Все</option>{options}</select>'
+
+
+TOKEN_PAGE = (
+    '<html><body><form action="/FindCem/Find" method="post">'
+    f'<input name="__RequestVerificationToken" type="hidden" value="{TOKEN}" />'
+    f'{_select("RegTypeID", REGISTRIES)}{_select("RegionID", REGIONS)}'
+    '</form></body></html>'
+).encode('utf-8')
+
+
+class FasStub:
+    """
+    Состояние заглушки: тело ответа, задержка и количество ответов 503 перед успешным.
+    page - тело ответа в памяти (отдаётся со сжатием gzip) или путь к файлу со страницей.
+    row_delay - время «формирования» ответа сайтом на каждую строку, truncate - сколько первых ответов
+    на запросы части реестра оборвать на середине таблицы
+    """
+
+    def __init__(self, page, delay: float = 0, fail: int = 0, row_delay: float = 0, truncate: int = 0):
+        self.delay = delay
+        self.fail = fail
+        self.row_delay = row_delay
+        self.truncate = truncate
+        self.requests = 0
+        self.partition_requests = 0
+        self.lock = threading.Lock()
+        self.set_page(page)
+
+    def set_page(self, page):
+        """ Подменяем список, который отдаёт заглушка (следующая ревизия реестра) """
+        self.page = page
+        self.gzip_page = gzip.compress(page) if isinstance(page, bytes) else None
+        self.registry = None
+        self.page_rows = 0
+        self.partitions = {}
+
+    def set_registry(self, rows: int, revision: int = 0):
+        """ Синтетический список на rows строк: заглушка отдаёт и весь список, и выборки по региону и типу """
+        self.set_page(synthetic_page(rows, revision))
+        self.registry = (rows, revision)
+        self.page_rows = sum(1 for _ in row_numbers(rows, revision))
+
+    def partition(self, region: int, registry: int):
+        """ Выборка по региону и типу реестра: тело, тело в gzip и количество строк """
+        key = (region, registry)
+        with self.lock:
+            if key not in self.partitions:
+                rows, revision = self.registry
+                body = synthetic_page(rows, revision, region=region, registry=registry)
+                count = sum(1 for number in row_numbers(rows, revision) if in_partition(number, region, registry))
+                self.partitions[key] = (body, gzip.compress(body), count)
+            return self.partitions[key]
+
+    def handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, code: int, body: bytes, compress: bool = False, gzip_body: bytes = None):
+                if compress and 'gzip' in self.headers.get('Accept-Encoding', ''):
+                    body = gzip_body or (stub.gzip_page if body is stub.page else gzip.compress(body))
+                    self.send_response(code)
+                    self.send_header('Content-Encoding', 'gzip')
+                else:
+                    self.send_response(code)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                self._send(200, TOKEN_PAGE)
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                form = parse_qs(self.rfile.read(length).decode('utf-8'))
+                with stub.lock:
+                    stub.requests += 1
+                    failing = stub.requests <= stub.fail
+                if failing:
+                    self._send(503, b'Service Unavailable')
+                    return
+                if form.get('__RequestVerificationToken') != [TOKEN]:
+                    self._send(403, b'Forbidden')
+                    return
+                region, registry = (int(form.get(field, ['0'])[0] or 0) for field in ('RegionID', 'RegTypeID'))
+                if (region or registry) and stub.registry is not None:
+                    body, gzip_body, count = stub.partition(region, registry)
+                    with stub.lock:
+                        stub.partition_requests += 1
+                        truncated = stub.partition_requests <= stub.truncate
+                    time.sleep(stub.delay + stub.row_delay * count)
+                    if truncated:
+                        # Ответ обрывается на середине таблицы, но соединение закрывается штатно
+                        self._send(200, body[:len(body) // 2])
+                    else:
+                        self._send(200, body, compress=True, gzip_body=gzip_body)
+                    return
+                time.sleep(stub.delay + stub.row_delay * stub.page_rows)
+                page = stub.page
+                if isinstance(page, bytes):
+                    self._send(200, page, compress=True)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(os.path.getsize(page)))
+                self.end_headers()
+                with open(page, 'rb') as page_file:
+                    shutil.copyfileobj(page_file, self.wfile, 1024 * 1024)
+
+        return Handler
+
+
+def serve(stub: FasStub, host: str = '127.0.0.1', port: int = 0) -> ThreadingHTTPServer:
+    """ Запускаем заглушку в фоновом потоке. Порт 0 - выбрать свободный """
+    server = ThreadingHTTPServer((host, port), stub.handler())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    arguments = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arguments.add_argument('--page', help='сохранённая HTML страница с таблицей реестра ФАС')
+    arguments.add_argument('--rows', type=int, default=5000)
+    arguments.add_argument('--host', default='127.0.0.1')
+    arguments.add_argument('--port', type=int, default=8090)
+    arguments.add_argument('--delay', type=float, default=0, help='задержка перед ответом с таблицей, с')
+    arguments.add_argument('--fail', type=int, default=0, help='сколько первых запросов таблицы ответить 503')
+    arguments.add_argument('--row-delay', type=float, default=0, help='время формирования ответа на строку, с')
+    arguments.add_argument('--truncate', type=int, default=0, help='сколько первых ответов с частью реестра оборвать')
+    args = arguments.parse_args()
+
+    stub = FasStub(args.page or b'', args.delay, args.fail, args.row_delay, args.truncate)
+    if not args.page:
+        stub.set_registry(args.rows)
+
+    server = ThreadingHTTPServer((args.host, args.port), stub.handler())
+    print(f'FAS stub on http://{args.host}:{args.port}/FindCem/')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
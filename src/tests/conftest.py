@@ -0,0 +1,5 @@
+import os
+
+# Журнал приложения пишется в logs/ относительно рабочего каталога (app.settings); тесты запускаются из src
+os.makedirs('logs', exist_ok=True)
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
@@ -0,0 +1,99 @@
+"""
+Проверка FasClient на локальной заглушке сайта ФАС: повторы после 5xx, таймаут чтения, сжатие gzip
+и потоковое чтение тела ответа:
+
+    cd src && python -m pytest tests
+"""
+import time
+import pytest
+from fastapi import HTTPException
+from app.services.fas_client import FasClient
+from app.settings import settings
+from benchmarks.fas_page import synthetic_page
+from benchmarks.fas_stub import TOKEN, FasStub, serve
+
+SETTINGS = ('cookies_url_fas', 'url_fas', 'fas_retries', 'fas_backoff', 'fas_read_timeout')
+
+
+@pytest.fixture(scope='module')
+def stub():
+    stub = FasStub(synthetic_page(2000))
+    server = serve(stub)
+    stub.base_url = 'http://127.0.0.1:%d/FindCem/' % server.server_address[1]
+    yield stub
+    server.shutdown()
+
+
+@pytest.fixture()
+def client_for(stub):
+    """ Клиент с адресами заглушки; настройки пула, таймаутов и повторов читаются при создании клиента """
+    defaults = {name: getattr(settings, name) for name in SETTINGS}
+
+    def create(**overrides) -> FasClient:
+        settings.cookies_url_fas, settings.url_fas = stub.base_url, stub.base_url + 'Find'
+        for name, value in overrides.items():
+            setattr(settings, 'fas_' + name, value)
+        return FasClient()
+
+    stub.requests, stub.fail, stub.delay = 0, 0, 0
+    yield create
+    stub.fail, stub.delay = 0, 0
+    for name, value in defaults.items():
+        setattr(settings, name, value)
+
+
+def read_body(response) -> bytes:
+    chunks = list(response.iter_content(chunk_size=settings.fas_chunk_size))
+    response.close()
+    return b''.join(chunks)
+
+
+def test_gzip_streaming(stub, client_for):
+    """ Тело приходит сжатым, а iter_content отдаёт его распакованным по частям """
+    client = client_for(retries=0)
+    token = client.get_token()
+    assert token == TOKEN
+    response = client.fetch_registry(token)
+    assert response.status_code == 200
+    assert response.headers.get('Content-Encoding') == 'gzip'
+    assert int(response.headers['Content-Length']) < len(stub.page)
+    chunks = list(response.iter_content(chunk_size=4096))
+    response.close()
+    assert len(chunks) > 1, 'body is not streamed'
+    assert b''.join(chunks) == stub.page
+
+
+def test_retry_after_5xx(stub, client_for):
+    """ Два ответа 503 подряд - клиент повторяет запрос и получает таблицу с третьей попытки """
+    client = client_for(retries=3, backoff=0.01)
+    token = client.get_token()
+    stub.requests, stub.fail = 0, 2
+    body = read_body(client.fetch_registry(token))
+    assert stub.requests == 3
+    assert body == stub.page
+
+
+def test_retries_exhausted(stub, client_for):
+    """ Если 5xx больше, чем повторов, клиент отвечает HTTPException 400, а не зависает """
+    client = client_for(retries=1, backoff=0.01)
+    token = client.get_token()
+    stub.requests, stub.fail = 0, 5
+    with pytest.raises(HTTPException) as error:
+        client.fetch_registry(token)
+    assert error.value.status_code == 400
+    assert stub.requests == 2
+
+
+def test_read_timeout(stub, client_for):
+    """ Сайт не отвечает дольше fas_read_timeout - запрос прерывается по таймауту после повторов """
+    client = client_for(retries=1, backoff=0.01, read_timeout=0.2)
+    token = client.get_token()
+    stub.requests, stub.delay = 0, 1.0
+    started = time.perf_counter()
+    with pytest.raises(HTTPException) as error:
+        client.fetch_registry(token)
+    elapsed = time.perf_counter() - started
+    assert error.value.status_code == 400
+    # Две попытки по fas_read_timeout с запасом на соединение, а не задержка заглушки
+    assert elapsed < 2 * (settings.fas_read_timeout + 0.5)
+    assert stub.requests == 2